@@ -25,6 +25,7 @@ def get_models(configs_root_dir: str,
                device: str,
                n_warmups: int = 10,
                compile_score_head: bool = False,
+               freeze_score_head: bool = False,
                strict_load: bool = False,
                half_precision: bool = False,
                ):
@@ -53,6 +54,10 @@ def get_models(configs_root_dir: str,
     if compile_score_head:
         if model.score_head.jittable:
             model.score_head = torch.jit.script(model.score_head)
+            if freeze_score_head:
+                # Inline parameters as constants so that constant folding and linear+bias fusion can fire. The frozen head is inference-only.
+                model.score_head = torch.jit.freeze(model.score_head, preserved_attrs=['warmup'])
+                model.score_head = torch.jit.optimize_for_inference(model.score_head, other_methods=['warmup'])
 
     print(f"Warming up the model for {n_warmups} iterations", flush=True)
     if n_warmups:
@@ -71,16 +76,17 @@ class DiffusionEdfAgent():
                  unprocess_config,
                  device: str,
                  compile_score_head: bool = False,
+                 freeze_score_head: bool = False,
                  half_precision: bool = False,
                  critic_kwargs: Optional[Dict] = None):
         if critic_kwargs is not None:
-            self.critic = get_models(**critic_kwargs, device=device, compile_score_head=compile_score_head, half_precision=half_precision)
+            self.critic = get_models(**critic_kwargs, device=device, compile_score_head=compile_score_head, freeze_score_head=freeze_score_head, half_precision=half_precision)
         else:
             self.critic = None
         
         self.models = []
         for kwargs in model_kwargs_list:
-            self.models.append(get_models(**kwargs, device=device, compile_score_head=compile_score_head, half_precision=half_precision))
+            self.models.append(get_models(**kwargs, device=device, compile_score_head=compile_score_head, freeze_score_head=freeze_score_head, half_precision=half_precision))
 
         self.proc_fn = train_utils.compose_proc_fn(preprocess_config=preprocess_config)
         self.unprocess_fn = train_utils.compose_proc_fn(preprocess_config=unprocess_config)
@@ -23,6 +23,7 @@ if __name__ == '__main__':
     parser.add_argument('--server-name', type=str, default='agent', help='')
     parser.add_argument('--init-nameserver', action='store_true', help='')
     parser.add_argument('--compile-score-model-head', action='store_true', help='compile score head with torch.jit.script for faster inference, but may cause bug')
+    parser.add_argument('--freeze-score-model-head', action='store_true', help='additionally freeze the compiled score head with torch.jit.freeze and optimize_for_inference')
     parser.add_argument('--nameserver-host-ip', type=str, default='', help='')
     parser.add_argument('--nameserver-host-port', type=str, default='', help='')
     args = parser.parse_args()
@@ -30,6 +31,7 @@ if __name__ == '__main__':
     server_name = args.server_name
     init_nameserver = args.init_nameserver
     compile_score_head = args.compile_score_model_head
+    freeze_score_head = args.freeze_score_model_head
     nameserver_host_ip = args.nameserver_host_ip
     nameserver_host_port = args.nameserver_host_port
     if not init_nameserver:
@@ -73,6 +75,7 @@ if __name__ == '__main__':
         unprocess_config=unprocess_config,
         device=device,
         compile_score_head=compile_score_head,
+        freeze_score_head=freeze_score_head,
         critic_kwargs=agent_configs['model_kwargs'].get(f"pick_critic_kwargs", None)
     )
 
@@ -82,6 +85,7 @@ if __name__ == '__main__':
         unprocess_config=unprocess_config,
         device=device,
         compile_score_head=compile_score_head,
+        freeze_score_head=freeze_score_head,
         critic_kwargs=agent_configs['model_kwargs'].get(f"place_critic_kwargs", None)
     )
 
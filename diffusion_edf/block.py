@@ -11,9 +11,10 @@ from diffusion_edf.equiformer.tensor_product_rescale import FullyConnectedTensor
 from diffusion_edf.equiformer.layer_norm import EquivariantLayerNormV2
 from diffusion_edf.equiformer.graph_attention_transformer import sort_irreps_even_first
 
-from diffusion_edf.graph_attention import GraphAttentionMLP
+from diffusion_edf.graph_attention import GraphAttentionMLP, fused_edge_message
 from diffusion_edf.connectivity import FpsPool, RadiusGraph, RadiusConnect
 from diffusion_edf.radial_func import GaussianRadialBasisLayerFiniteCutoff
+from diffusion_edf.utils import mlp_mid_irreps
 
 
 #@compile_mode('script')
@@ -40,6 +41,7 @@ class FeedForwardNetwork(torch.nn.Module):
         self.fctp_2 = FullyConnectedTensorProductRescale(
             self.irreps_mlp_mid, self.irreps_node_attr, self.irreps_node_output, 
             bias=bias, rescale=rescale)
+        self.register_buffer('one_attr', torch.ones(1, 1), persistent=False) # "1x0e" node attribute, broadcasted as a view in forward.
         
         if not proj_drop:
             self.proj_drop = None
@@ -48,7 +50,10 @@ class FeedForwardNetwork(torch.nn.Module):
             
         
     def forward(self, node_input: torch.Tensor) -> torch.Tensor:
-        node_attr = torch.ones_like(node_input[:, 0:1])
+        node_attr = self.one_attr
+        if node_attr.dtype != node_input.dtype: # Only for mixed precision (e.g., half inputs to an fp32 module), so the cached buffer stays free in the common case.
+            node_attr = node_attr.to(dtype=node_input.dtype)
+        node_attr = node_attr.expand(node_input.size(0), 1)
         node_output: torch.Tensor = self.fctp_1(node_input, node_attr)
         node_output: torch.Tensor = self.fctp_2(node_output, node_attr)
         if self.proj_drop is not None:
@@ -77,6 +82,9 @@ class EquiformerBlock(torch.nn.Module):
         src_bias: bool = False,
         dst_bias: bool = True,
         dst_feature_layer: bool = True,
+        shared_src_dst: bool = False,
+        bf16: bool = False,
+        prenorm: bool = False,
         debug: bool = False):
         self.debug = debug
         
@@ -87,21 +95,36 @@ class EquiformerBlock(torch.nn.Module):
         self.irreps_head: o3.Irreps = o3.Irreps(irreps_head)
         self.num_heads: int = num_heads
         self.fc_neurons: List[int] = fc_neurons
+        self.bf16: bool = bf16 # Run the projections, attention and ffn under bf16 autocast on CUDA. Layer norms and skip connections stay in the input dtype.
 
         self.irreps_emb: o3.Irreps = self.irreps_dst
+        self.emb_dim: int = self.irreps_emb.dim
         assert num_heads*self.irreps_head.dim == self.irreps_emb.dim, f"{num_heads} X {self.irreps_head} != {self.irreps_emb}"
         if isinstance(irreps_mlp_mid, o3.Irreps):
             self.irreps_mlp_mid: o3.Irreps = o3.Irreps(irreps_mlp_mid)
         elif isinstance(irreps_mlp_mid, int):
-            self.irreps_mlp_mid = sort_irreps_even_first((self.irreps_emb * irreps_mlp_mid))[0].simplify()
+            self.irreps_mlp_mid = mlp_mid_irreps(self.irreps_emb, irreps_mlp_mid)
 
+        self.prenorm: bool = prenorm # If False, norm_1 is skipped (its output was never used by the original implementation, so pretrained weights expect unnormalized inputs).
         self.norm_1_src = EquivariantLayerNormV2(self.irreps_src)
-        self.linear_src = LinearRS(self.irreps_src, self.irreps_emb, bias=src_bias)
+        self.shared_src_dst: bool = shared_src_dst and not prenorm # norm_1_src/norm_1_dst give different inputs, so fusing would project both through 2x emb weights.
+        if self.shared_src_dst:
+            # Self-attention: project src and dst features with a single LinearRS and split the output.
+            assert dst_feature_layer is True
+            assert self.irreps_src == self.irreps_dst, f"{self.irreps_src} != {self.irreps_dst}"
+            self.linear_src = None
+            self.linear_src_dst = LinearRS(self.irreps_src, self.irreps_emb + self.irreps_emb, bias=(src_bias or dst_bias))
+        else:
+            self.linear_src = LinearRS(self.irreps_src, self.irreps_emb, bias=src_bias)
+            self.linear_src_dst = None
 
         if dst_feature_layer is True:
             self.dst_feature_layer = True
             self.norm_1_dst = EquivariantLayerNormV2(self.irreps_dst)
-            self.linear_dst = LinearRS(self.irreps_dst, self.irreps_emb, bias=dst_bias)
+            if self.shared_src_dst:
+                self.linear_dst = None
+            else:
+                self.linear_dst = LinearRS(self.irreps_dst, self.irreps_emb, bias=dst_bias)
         else:
             self.dst_feature_layer = False
             assert dst_bias is False
@@ -144,28 +167,42 @@ class EquiformerBlock(torch.nn.Module):
                 edge_src: torch.Tensor,
                 edge_dst: torch.Tensor,
                 edge_attr: torch.Tensor,
-                edge_scalars: torch.Tensor) -> torch.Tensor:
-
-        message_src: torch.Tensor = self.norm_1_src(node_input_src)
-        message_src: torch.Tensor = self.linear_src(node_input_src)
-
-        message_dst: torch.Tensor = self.norm_1_dst(node_input_dst)
-        message_dst: torch.Tensor = self.linear_dst(node_input_dst)
+                edge_scalars: torch.Tensor,
+                rowptr: Optional[torch.Tensor] = None) -> torch.Tensor:
+        use_bf16: bool = self.bf16 and node_input_dst.is_cuda
 
-        message: torch.Tensor = message_src[edge_src] + message_dst[edge_dst]
-        
-        node_features: torch.Tensor = self.ga(message=message, 
-                                              edge_dst=edge_dst, 
-                                              edge_attr=edge_attr, 
-                                              edge_scalars=edge_scalars,
-                                              n_nodes_dst = len(node_input_dst))
+        if self.prenorm:
+            message_src: torch.Tensor = self.norm_1_src(node_input_src)
+            message_dst: torch.Tensor = self.norm_1_dst(node_input_dst)
+        else:
+            message_src, message_dst = node_input_src, node_input_dst
+        with torch.autocast(device_type='cuda', dtype=torch.bfloat16, enabled=use_bf16):
+            if self.linear_src_dst is not None:
+                assert message_src is message_dst, "shared_src_dst requires node_input_src and node_input_dst to be the same tensor (self-attention)."
+                emb_dim: int = self.emb_dim
+                message_src, message_dst = self.linear_src_dst(message_src).split([emb_dim, emb_dim], dim=-1)
+            else:
+                message_src: torch.Tensor = self.linear_src(message_src)
+                message_dst: torch.Tensor = self.linear_dst(message_dst)
+
+            message: torch.Tensor = fused_edge_message(message_src, message_dst, edge_src, edge_dst)
+            
+            node_features: torch.Tensor = self.ga(message=message, 
+                                                  edge_dst=edge_dst, 
+                                                  edge_attr=edge_attr, 
+                                                  edge_scalars=edge_scalars,
+                                                  n_nodes_dst = len(node_input_dst),
+                                                  rowptr = rowptr)
+        node_features = node_features.type_as(node_input_dst)
         
         if self.drop_path is not None:
             node_features = self.drop_path(node_features, batch_dst)
         node_output: torch.Tensor = node_input_dst + node_features # skip connection
         
         node_features: torch.Tensor = self.norm_2(node_output, batch=batch_dst)
-        node_features: torch.Tensor = self.ffn(node_features)
+        with torch.autocast(device_type='cuda', dtype=torch.bfloat16, enabled=use_bf16):
+            node_features: torch.Tensor = self.ffn(node_features)
+        node_features = node_features.type_as(node_output)
         
         if self.drop_path is not None:
             node_features = self.drop_path(node_features, batch_dst)
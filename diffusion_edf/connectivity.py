@@ -1,8 +1,83 @@
 from typing import Tuple, List, Dict, Optional, Union
+import math
 
 import torch
 from torch_cluster import radius_graph, radius, fps, graclus
-from torch_scatter import scatter_add, scatter_mean
+from torch_scatter import scatter_add, scatter_mean, scatter_max
+
+try:
+    import fpsample # Optional: bucket-based farthest point sampling (QuickFPS) for CPU point clouds.
+except ImportError:
+    fpsample = None
+
+
+@torch.jit.script
+def sort_edges_by_dst(edge_src: torch.Tensor, edge_dst: torch.Tensor, n_src: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    perm = torch.argsort(edge_dst * n_src + edge_src) # Sort by edge_dst (primary) and edge_src (secondary)
+    return edge_src.index_select(0, perm), edge_dst.index_select(0, perm)
+
+@torch.jit.script
+def edge_vec_and_length(node_coord_src: torch.Tensor, node_coord_dst: torch.Tensor, edge_src: torch.Tensor, edge_dst: torch.Tensor, normalize: bool = False) -> Tuple[torch.Tensor, torch.Tensor]:
+    """
+    normalize: If True, returns unit edge vectors so that spherical harmonics can be evaluated with normalize=False, reusing edge_length.
+    """
+    edge_vec = node_coord_src.index_select(0, edge_src).sub_(node_coord_dst.index_select(0, edge_dst)) # (N_edge, 3)
+    edge_length = torch.linalg.vector_norm(edge_vec, dim=1)                                         # (N_edge, )
+    if normalize:
+        edge_vec = edge_vec / edge_length.clamp_min(1e-12).unsqueeze(-1)                           # Same eps as torch.nn.functional.normalize
+    return edge_vec, edge_length
+
+@torch.jit.script
+def degree_to_rowptr(degree: torch.Tensor) -> torch.Tensor:
+    return torch.cat([degree.new_zeros(1), torch.cumsum(degree, dim=0)], dim=0) # (N_dst+1, )
+
+def bucket_fps(src: torch.Tensor, batch: torch.Tensor, ratio: float, random_start: bool, h: int = 5) -> torch.Tensor:
+    """
+    Drop-in replacement of torch_cluster.fps using fpsample.bucket_fps_kdline_sampling.
+    Same sampling count per batch (ceil(ratio * N_batch)) and the same start convention (index 0 if not random_start).
+    Assumes that batch is sorted, as torch_cluster.fps does.
+    """
+    assert fpsample is not None
+    _, counts = torch.unique_consecutive(batch, return_counts=True)
+    src_np = src.detach().to(dtype=torch.float32).contiguous().numpy() # fpsample expects a C-contiguous float32 array.
+    node_dst_idx: List[torch.Tensor] = []
+    offset: int = 0
+    for count in counts.tolist():
+        n_samples: int = math.ceil(ratio * count)
+        start_idx: int = int(torch.randint(count, (1,))) if random_start else 0
+        idx = fpsample.bucket_fps_kdline_sampling(src_np[offset:offset+count], n_samples, h=h, start_idx=start_idx)
+        node_dst_idx.append(torch.from_numpy(idx.astype('int64')) + offset)
+        offset += count
+    return torch.cat(node_dst_idx, dim=0)
+
+def fps_fixed(src: torch.Tensor, batch: torch.Tensor, ratio: float, random_start: bool, n_iters: Optional[int] = None) -> torch.Tensor:
+    """
+    Pure-pytorch farthest point sampling with the same output as torch_cluster.fps (ceil(ratio * N_batch) samples per batch, batch-major, in selection order).
+    All batches are sampled simultaneously, so the number of kernel launches only depends on n_iters (= max samples per batch), not on the number of batches.
+    n_iters: Optional upper bound on the samples per batch (must be >= max samples per batch); computed from the input if None.
+    Not sync-free: the output size is data dependent (grouping by batch and the final masked gather synchronize with the host), so it cannot be captured by CUDA graphs.
+    Assumes that batch is sorted, as torch_cluster.fps does.
+    """
+    _, batch_idx, counts = torch.unique_consecutive(batch, return_inverse=True, return_counts=True) # (N,), (B,)
+    n_samples = torch.ceil(counts.type(src.dtype) * ratio).type(torch.long)                       # (B,) In src.dtype, as torch_cluster.fps does (keeps float rounding of ceil identical).
+    if n_iters is None:
+        n_iters = int(n_samples.max())
+    ptr = torch.cumsum(counts, dim=0) - counts                                                     # (B,)
+    if random_start:
+        selected = ptr + (torch.rand(len(counts), device=src.device) * counts).type(torch.long)    # (B,)
+    else:
+        selected = ptr                                                                             # (B,)
+
+    dist = torch.full((len(src),), float('inf'), dtype=src.dtype, device=src.device)            # (N,)
+    node_dst_idx = torch.empty(len(counts), n_iters, dtype=torch.long, device=src.device)        # (B, n_iters)
+    for i in range(n_iters):
+        node_dst_idx[:, i] = selected
+        new_dist = (src - src.index_select(0, selected).index_select(0, batch_idx)).square().sum(dim=-1) # (N,)
+        dist = torch.minimum(dist, new_dist)
+        _, selected = scatter_max(dist, batch_idx, dim=0, dim_size=len(counts))                    # (B,)
+
+    mask = torch.arange(n_iters, device=src.device) < n_samples.unsqueeze(-1)                     # (B, n_iters)
+    return node_dst_idx[mask]
 
 
 class RadiusGraph(torch.nn.Module):
@@ -11,7 +86,7 @@ class RadiusGraph(torch.nn.Module):
         self.r: float = r
         self.max_num_neighbors: int = max_num_neighbors
 
-    def forward(self, node_coord_src: torch.Tensor, node_feature_src: torch.Tensor, batch_src: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor,]:
+    def forward(self, node_coord_src: torch.Tensor, node_feature_src: torch.Tensor, batch_src: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         assert node_coord_src.ndim == 2 and node_coord_src.shape[-1] == 3
 
         node_coord_dst = node_coord_src
@@ -22,10 +97,12 @@ class RadiusGraph(torch.nn.Module):
         edge = radius_graph(node_coord_dst, r=self.r, batch=batch_dst, loop=False, max_num_neighbors=self.max_num_neighbors)
         edge_dst = edge[0]
         edge_src = edge[1]
+        edge_src, edge_dst = sort_edges_by_dst(edge_src=edge_src, edge_dst=edge_dst, n_src=N_nodes) # Edges are grouped by destination so that aggregation can be done with CSR segment reduction.
         degree = scatter_add(src = torch.ones_like(edge_dst), index = edge_dst, dim=0, dim_size=N_nodes)
+        rowptr = degree_to_rowptr(degree)
 
         
-        return node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst
+        return node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst, rowptr
     
 
 
@@ -42,24 +119,31 @@ class RadiusConnect(torch.nn.Module):
         edge = radius(x = node_coord_src, y = node_coord_dst, r=self.r, batch_x=batch_src, batch_y=batch_dst, max_num_neighbors=self.max_num_neighbors)
         edge_dst = edge[0]
         edge_src = edge[1]
+        edge_src, edge_dst = sort_edges_by_dst(edge_src=edge_src, edge_dst=edge_dst, n_src=len(node_coord_src))
 
         return edge_src, edge_dst
     
 
 
 class FpsPool(torch.nn.Module):
-    def __init__(self, ratio: float, random_start: bool, r: float, max_num_neighbors: int):
+    def __init__(self, ratio: float, random_start: bool, r: float, max_num_neighbors: int, bucket_fps: bool = False):
         super().__init__()
         self.ratio: float = ratio
         self.random_start: bool = random_start
+        self.bucket_fps: bool = bucket_fps # Use fpsample (bucket_fps) instead of torch_cluster.fps for CPU inputs. Sampled points differ from torch_cluster.fps.
+        if self.bucket_fps and fpsample is None:
+            raise ImportError("bucket_fps=True requires the fpsample package.")
         self.r: float = r
         self.max_num_neighbors: int = max_num_neighbors
         self.radius_connect = RadiusConnect(r=self.r, max_num_neighbors=self.max_num_neighbors)
 
-    def forward(self, node_coord_src: torch.Tensor, node_feature_src: torch.Tensor, batch_src: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor,]:
+    def forward(self, node_coord_src: torch.Tensor, node_feature_src: torch.Tensor, batch_src: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
         assert node_coord_src.ndim == 2 and node_coord_src.shape[-1] == 3
         
-        node_dst_idx = fps(src=node_coord_src, batch=batch_src, ratio=self.ratio, random_start=self.random_start)
+        if self.bucket_fps and node_coord_src.device.type == 'cpu':
+            node_dst_idx = bucket_fps(src=node_coord_src, batch=batch_src, ratio=self.ratio, random_start=self.random_start)
+        else:
+            node_dst_idx = fps(src=node_coord_src, batch=batch_src, ratio=self.ratio, random_start=self.random_start)
         node_coord_dst = node_coord_src.index_select(index=node_dst_idx, dim=0)
         batch_dst = batch_src.index_select(index=node_dst_idx, dim=0)
         N_nodes = len(node_dst_idx)
@@ -70,8 +154,9 @@ class FpsPool(torch.nn.Module):
         edge_src = edge_src[non_self_idx]
         edge_dst = edge_dst[non_self_idx]
 
-        degree = scatter_add(src = torch.ones_like(edge_dst), index = edge_dst, dim=0, dim_size=N_nodes)
+        degree = scatter_add(src = torch.ones_like(edge_dst), index = edge_dst, dim=0, dim_size=N_nodes) # Filtering preserves the destination-sorted order.
+        rowptr = degree_to_rowptr(degree)
         #node_feature_dst = scatter_mean(src = node_feature_src.index_select(index=edge_src, dim=0), index = edge_dst, dim=0, dim_size=N_nodes)
         node_feature_dst = node_feature_src.index_select(index=node_dst_idx, dim=0)
 
-        return node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst
\ No newline at end of file
+        return node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst, rowptr
\ No newline at end of file
@@ -82,6 +82,9 @@ class EquivariantLayerNormV2(nn.Module):
 
         assert normalization in ['norm', 'component'], "normalization needs to be 'norm' or 'component'"
         self.normalization: str = normalization
+        
+        # A single block of even scalars (e.g., "16x0e") is exactly nn.LayerNorm (d=1 => 'norm' and 'component' coincide)
+        self.scalar_only: bool = len(self.irreps) == 1 and self.irreps[0].ir.l == 0 and self.irreps[0].ir.p == 1
 
 
     def __repr__(self):
@@ -94,6 +97,8 @@ class EquivariantLayerNormV2(nn.Module):
         # node_input has shape [batch * nodes, dim], but with variable nr of nodes.
         # the node_input batch slices this into separate graphs
         dim: int = node_input.shape[-1]
+        if self.scalar_only:
+            return torch.nn.functional.layer_norm(node_input, [dim], self.affine_weight, self.affine_bias, self.eps)
 
         fields = []
         ix: int = 0
@@ -178,9 +178,13 @@ class LinearRS(FullyConnectedTensorProductRescale):
         super().__init__(irreps_in, o3.Irreps('1x0e'), irreps_out, 
             bias=bias, rescale=rescale, internal_weights=True, 
             shared_weights=True, normalization=None)
+        self.register_buffer('one_attr', torch.ones(1, 1), persistent=False)
     
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        y = torch.ones_like(x[:, 0:1])
+        y = self.one_attr
+        if y.dtype != x.dtype: # Only for mixed precision (e.g., half inputs to an fp32 module), so the cached buffer stays free in the common case.
+            y = y.to(dtype=x.dtype)
+        y = y.expand(x.size(0), 1)
         out = self.forward_tp_rescale_bias(x, y)
         return out
     
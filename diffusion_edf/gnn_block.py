@@ -11,8 +11,8 @@ from diffusion_edf.equiformer.tensor_product_rescale import FullyConnectedTensor
 from diffusion_edf.equiformer.layer_norm import EquivariantLayerNormV2
 from diffusion_edf.equiformer.graph_attention_transformer import sort_irreps_even_first
 
-from diffusion_edf.graph_attention import GraphAttentionMLP2
-from diffusion_edf.utils import multiply_irreps
+from diffusion_edf.graph_attention import GraphAttentionMLP2, fused_edge_message
+from diffusion_edf.utils import multiply_irreps, mlp_mid_irreps
 from diffusion_edf.gnn_data import FeaturedPoints, GraphEdge
 from diffusion_edf.skip import ProjectIfMismatch
 
@@ -41,6 +41,7 @@ class FeedForwardNetwork(torch.nn.Module):
         self.fctp_2 = FullyConnectedTensorProductRescale(
             self.irreps_mlp_mid, self.irreps_node_attr, self.irreps_node_output, 
             bias=bias, rescale=rescale)
+        self.register_buffer('one_attr', torch.ones(1, 1), persistent=False) # "1x0e" node attribute, broadcasted as a view in forward.
         
         if not proj_drop:
             self.proj_drop = None
@@ -49,7 +50,10 @@ class FeedForwardNetwork(torch.nn.Module):
             
         
     def forward(self, node_input: torch.Tensor) -> torch.Tensor:
-        node_attr = torch.ones_like(node_input[:, 0:1])
+        node_attr = self.one_attr
+        if node_attr.dtype != node_input.dtype: # Only for mixed precision (e.g., half inputs to an fp32 module), so the cached buffer stays free in the common case.
+            node_attr = node_attr.to(dtype=node_input.dtype)
+        node_attr = node_attr.expand(node_input.size(0), 1)
         node_output: torch.Tensor = self.fctp_1(node_input, node_attr)
         node_output: torch.Tensor = self.fctp_2(node_output, node_attr)
         if self.proj_drop is not None:
@@ -103,7 +107,7 @@ class EquiformerBlock(torch.nn.Module):
         if isinstance(irreps_mlp_mid, o3.Irreps):
             self.irreps_mlp_mid: o3.Irreps = o3.Irreps(irreps_mlp_mid)
         elif isinstance(irreps_mlp_mid, int):
-            self.irreps_mlp_mid = sort_irreps_even_first((self.irreps_emb * irreps_mlp_mid))[0].simplify()
+            self.irreps_mlp_mid = mlp_mid_irreps(self.irreps_emb, irreps_mlp_mid)
         self.num_heads: int = num_heads
         self.fc_neurons: List[int] = fc_neurons
         self.use_dst_feature: bool = use_dst_feature
@@ -163,7 +167,8 @@ class EquiformerBlock(torch.nn.Module):
             
     def forward(self, src_points: FeaturedPoints, 
                 dst_points: FeaturedPoints,
-                graph_edge: GraphEdge) -> FeaturedPoints:
+                graph_edge: GraphEdge,
+                rowptr: Optional[torch.Tensor] = None) -> FeaturedPoints:
         assert src_points.x.ndim == 2
         assert dst_points.x.ndim == 2
         
@@ -176,9 +181,7 @@ class EquiformerBlock(torch.nn.Module):
             message_dst = self.prenorm_dst(dst_points.f) # Shape: (N_dst, F_dst)
             if self.linear_dst is not None:
                 message_dst = self.linear_dst(message_dst) # Shape: (N_dst, F_emb)
-        message: torch.Tensor = message_src[graph_edge.edge_src]         # Shape: (N_edge, F_emb)
-        if message_dst is not None:
-            message = message + message_dst[graph_edge.edge_dst]         # Shape: (N_edge, F_emb)
+        message: torch.Tensor = fused_edge_message(message_src, message_dst, graph_edge.edge_src, graph_edge.edge_dst) # Shape: (N_edge, F_emb)
 
         ### Edge Pre Attention (for edge cutoff) ###
         if self.use_edge_weights:
@@ -200,7 +203,8 @@ class EquiformerBlock(torch.nn.Module):
                                              graph_edge=graph_edge,
                                              n_nodes_dst = len(dst_points.x),
                                              edge_pre_attn_logit = edge_pre_attn_logit,
-                                             edge_post_attn = edge_post_attn) # Shape: (N_dst, F_emb)
+                                             edge_post_attn = edge_post_attn,
+                                             rowptr = rowptr) # Shape: (N_dst, F_emb)
         
         if self.drop_path is not None:
             emb_features = self.drop_path(x=emb_features, batch=dst_points.b) # Shape: (N_dst, F_emb)
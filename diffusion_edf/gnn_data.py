@@ -217,6 +217,71 @@ def cat_graph_edges(graph_edge_1: GraphEdge, graph_edge_2: GraphEdge) -> GraphEd
                      edge_logits=edge_logits)
 
 
+@torch.jit.script
+def _cat_optional_tensors(tensors: List[Optional[torch.Tensor]]) -> Optional[torch.Tensor]:
+    out: List[torch.Tensor] = []
+    for tensor in tensors:
+        if tensor is not None:
+            out.append(tensor)
+    if len(out) == 0:
+        return None
+    assert len(out) == len(tensors)
+    return torch.cat(out, dim=0)
+
+@torch.jit.script
+def cat_graph_edges_list(graph_edges: List[GraphEdge]) -> GraphEdge:
+    edge_src: List[torch.Tensor] = []
+    edge_dst: List[torch.Tensor] = []
+    edge_length: List[Optional[torch.Tensor]] = []
+    edge_attr: List[Optional[torch.Tensor]] = []
+    edge_scalars: List[Optional[torch.Tensor]] = []
+    edge_weights: List[Optional[torch.Tensor]] = []
+    edge_logits: List[Optional[torch.Tensor]] = []
+    for graph_edge in graph_edges:
+        edge_src.append(graph_edge.edge_src)
+        edge_dst.append(graph_edge.edge_dst)
+        edge_length.append(graph_edge.edge_length)
+        edge_attr.append(graph_edge.edge_attr)
+        edge_scalars.append(graph_edge.edge_scalars)
+        edge_weights.append(graph_edge.edge_weights)
+        edge_logits.append(graph_edge.edge_logits)
+
+    return GraphEdge(edge_src=torch.cat(edge_src, dim=0), 
+                     edge_dst=torch.cat(edge_dst, dim=0), 
+                     edge_length=_cat_optional_tensors(edge_length),
+                     edge_attr=_cat_optional_tensors(edge_attr),
+                     edge_scalars=_cat_optional_tensors(edge_scalars),
+                     edge_weights=_cat_optional_tensors(edge_weights),
+                     edge_logits=_cat_optional_tensors(edge_logits))
+
+
+@torch.jit.script
+def permute_graph_edges(graph_edge: GraphEdge, perm: torch.Tensor) -> GraphEdge:
+    edge_length = graph_edge.edge_length
+    if edge_length is not None:
+        edge_length = edge_length.index_select(0, perm)
+    edge_attr = graph_edge.edge_attr
+    if edge_attr is not None:
+        edge_attr = edge_attr.index_select(0, perm)
+    edge_scalars = graph_edge.edge_scalars
+    if edge_scalars is not None:
+        edge_scalars = edge_scalars.index_select(0, perm)
+    edge_weights = graph_edge.edge_weights
+    if edge_weights is not None:
+        edge_weights = edge_weights.index_select(0, perm)
+    edge_logits = graph_edge.edge_logits
+    if edge_logits is not None:
+        edge_logits = edge_logits.index_select(0, perm)
+
+    return GraphEdge(edge_src=graph_edge.edge_src.index_select(0, perm), 
+                     edge_dst=graph_edge.edge_dst.index_select(0, perm), 
+                     edge_length=edge_length,
+                     edge_attr=edge_attr,
+                     edge_scalars=edge_scalars,
+                     edge_weights=edge_weights,
+                     edge_logits=edge_logits)
+
+
 @torch.jit.script
 def cat_featured_points(fp1: FeaturedPoints, fp2: FeaturedPoints) -> FeaturedPoints:
     x = torch.cat([fp1.x, fp2.x], dim=0)
@@ -234,4 +299,19 @@ def cat_featured_points(fp1: FeaturedPoints, fp2: FeaturedPoints) -> FeaturedPoi
     return FeaturedPoints(x=x, f=f, b=b, w=w)
 
 
+@torch.jit.script
+def cat_featured_points_list(fps: List[FeaturedPoints]) -> FeaturedPoints:
+    x: List[torch.Tensor] = []
+    f: List[torch.Tensor] = []
+    b: List[torch.Tensor] = []
+    w: List[Optional[torch.Tensor]] = []
+    for fp in fps:
+        x.append(fp.x)
+        f.append(fp.f)
+        b.append(fp.b)
+        w.append(fp.w)
+
+    return FeaturedPoints(x=torch.cat(x, dim=0), f=torch.cat(f, dim=0), b=torch.cat(b, dim=0), w=_cat_optional_tensors(w))
+
+
 
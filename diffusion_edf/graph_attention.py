@@ -3,7 +3,7 @@ from typing import List, Optional, Union, Tuple
 import torch
 from e3nn import o3
 from e3nn.util.jit import compile_mode
-from torch_scatter import scatter, scatter_softmax, scatter_logsumexp
+from torch_scatter import scatter, scatter_softmax, scatter_logsumexp, segment_csr, gather_csr
 
 from diffusion_edf.equiformer.tensor_product_rescale import LinearRS
 from diffusion_edf.equiformer.graph_attention_transformer import sort_irreps_even_first, get_mul_0, Vec2AttnHeads, AttnHeads2Vec, SmoothLeakyReLU, SeparableFCTP
@@ -12,6 +12,28 @@ from diffusion_edf.equiformer.fast_activation import Activation, Gate
 from diffusion_edf.gnn_data import GraphEdge, FeaturedPoints
 from diffusion_edf.irreps_utils import multiply_irreps, cutoff_irreps
 
+
+@torch.jit.script
+def fused_edge_message(message_src: torch.Tensor,
+                       message_dst: Optional[torch.Tensor],
+                       edge_src: torch.Tensor,
+                       edge_dst: torch.Tensor) -> torch.Tensor:
+    message = message_src.index_select(0, edge_src)                 # (N_edge, F_emb)
+    if message_dst is not None:
+        message = message.add_(message_dst.index_select(0, edge_dst)) # In-place to avoid a third (N_edge, F_emb) buffer.
+    return message
+
+@torch.jit.script
+def segment_softmax_csr(src: torch.Tensor, rowptr: torch.Tensor) -> torch.Tensor:
+    """
+    Softmax of src (N_edge, ...) over the edges of each destination node. Edges must be sorted by destination, with CSR offsets rowptr (N_dst+1, ).
+    Reduces contiguous segments instead of atomic scatters.
+    """
+    src_max = segment_csr(src.detach(), rowptr, reduce='max')    # (N_dst, ...)
+    out = (src - gather_csr(src_max, rowptr)).exp()             # (N_edge, ...)
+    out_sum = segment_csr(out, rowptr, reduce='sum')            # (N_dst, ...)
+    return out / gather_csr(out_sum, rowptr)                    # (N_edge, ...)
+
 #@compile_mode('script')
 class GraphAttentionMLP(torch.nn.Module):
     def __init__(self,
@@ -86,7 +108,8 @@ class GraphAttentionMLP(torch.nn.Module):
                 edge_attr: torch.Tensor, 
                 edge_scalars: torch.Tensor,
                 n_nodes_dst: int,
-                edge_attn: Optional[torch.Tensor] = None) -> torch.Tensor:
+                edge_attn: Optional[torch.Tensor] = None,
+                rowptr: Optional[torch.Tensor] = None) -> torch.Tensor:
       
         weight: torch.Tensor = self.sep_act.dtp_rad(edge_scalars)
         message: torch.Tensor = self.sep_act.dtp(message, edge_attr, weight)
@@ -99,19 +122,23 @@ class GraphAttentionMLP(torch.nn.Module):
         # inner product
         log_alpha = self.alpha_act(log_alpha)          # Leaky ReLU
         log_alpha = torch.einsum('ehk, hk -> eh', log_alpha, self.alpha_dot.squeeze(0)) # Linear layer: (N_edge, N_head mul_alpha_head) -> (N_edge, N_head)
+        log_alpha = log_alpha.float()                  # Softmax is always computed in fp32 (no-op unless under autocast / half precision)
         
         # alpha: torch.Tensor = scatter_softmax(log_alpha, edge_dst, dim=-2, dim_size=n_nodes_dst)          # Softmax
-        if False: # torch.are_deterministic_algorithms_enabled():
-            log_Z = scatter_logsumexp(log_alpha, edge_dst, dim=-2, dim_size = n_nodes_dst) # (NodeNum,1)
+        if rowptr is not None:
+            alpha = segment_softmax_csr(log_alpha, rowptr).type_as(value) # (N_edge, N_head)
         else:
             log_Z = scatter_logsumexp(log_alpha, edge_dst, dim=-2, dim_size = n_nodes_dst) # (NodeNum,1)
-        alpha = torch.exp(log_alpha - log_Z[edge_dst]) # (N_edge, N_head)
+            alpha = torch.exp(log_alpha - log_Z[edge_dst]).type_as(value) # (N_edge, N_head)
 
         alpha: torch.Tensor = alpha.unsqueeze(-1)                              # (N_edge, N_head, 1)
         if self.alpha_dropout is not None:
             alpha = self.alpha_dropout(alpha)
         attn: torch.Tensor = value * alpha                                     # (N_edge, N_head, head_dim)
-        attn: torch.Tensor = scatter(attn, index=edge_dst, dim=0, dim_size=n_nodes_dst)
+        if rowptr is None:
+            attn: torch.Tensor = scatter(attn, index=edge_dst, dim=0, dim_size=n_nodes_dst)
+        else:
+            attn: torch.Tensor = segment_csr(attn, rowptr, reduce='sum')       # Edges are sorted by edge_dst => no atomic scatter needed.
         attn: torch.Tensor = self.heads2vec(attn)
             
         node_output: torch.Tensor = self.proj(attn) # Final Linear layer.
@@ -219,7 +246,8 @@ class GraphAttentionMLP2(torch.nn.Module):
                 graph_edge: GraphEdge,
                 n_nodes_dst: int,
                 edge_pre_attn_logit: Optional[torch.Tensor] = None,
-                edge_post_attn: Optional[torch.Tensor] = None) -> torch.Tensor:
+                edge_post_attn: Optional[torch.Tensor] = None,
+                rowptr: Optional[torch.Tensor] = None) -> torch.Tensor:
         assert isinstance(graph_edge.edge_attr, torch.Tensor)
         assert isinstance(graph_edge.edge_scalars, torch.Tensor)
         assert message.ndim == 2 # (nEdge, F_in)
@@ -250,11 +278,11 @@ class GraphAttentionMLP2(torch.nn.Module):
 
         # if edge_post_attn is not None:
         #     log_alpha = log_alpha + torch.log(edge_post_attn).unsqueeze(-1)          # (N_edge, N_head)
-        if False: # torch.are_deterministic_algorithms_enabled():
-            log_Z = scatter_logsumexp(log_alpha, graph_edge.edge_dst, dim=-2, dim_size = n_nodes_dst) # (NodeNum,1)
+        if rowptr is not None:
+            alpha = segment_softmax_csr(log_alpha, rowptr)        # (N_edge, N_head)
         else:
             log_Z = scatter_logsumexp(log_alpha, graph_edge.edge_dst, dim=-2, dim_size = n_nodes_dst) # (NodeNum,1)
-        alpha = torch.exp(log_alpha - log_Z[graph_edge.edge_dst]) # (N_edge, N_head)
+            alpha = torch.exp(log_alpha - log_Z[graph_edge.edge_dst]) # (N_edge, N_head)
         if edge_post_attn is not None:
             alpha = alpha * edge_post_attn.unsqueeze(-1)          # (N_edge, N_head)
 
@@ -262,7 +290,10 @@ class GraphAttentionMLP2(torch.nn.Module):
         if self.alpha_dropout is not None:
             alpha = self.alpha_dropout(alpha)                                  # (N_edge, N_head, 1)
         attn: torch.Tensor = value * alpha                                     # (N_edge, N_head, F_attn//nHead)
-        attn: torch.Tensor = scatter(attn, index=graph_edge.edge_dst, dim=0, dim_size=n_nodes_dst) # (N_dst, N_head, F_attn//nHead)
+        if rowptr is None:
+            attn: torch.Tensor = scatter(attn, index=graph_edge.edge_dst, dim=0, dim_size=n_nodes_dst) # (N_dst, N_head, F_attn//nHead)
+        else:
+            attn: torch.Tensor = segment_csr(attn, rowptr, reduce='sum')                               # (N_dst, N_head, F_attn//nHead)
         attn: torch.Tensor = self.heads2vec(attn)                              # (N_dst, F_attn)
             
         node_output: torch.Tensor = self.proj(attn) # (N_dst, F_attn) -> (N_dst, F_out)           # Final Linear layer.
@@ -12,6 +12,7 @@ from e3nn import o3
 from diffusion_edf.gnn_data import FeaturedPoints, GraphEdge
 from diffusion_edf.radial_func import soft_square_cutoff_2, SinusoidalPositionEmbeddings, BesselBasisEncoder, GaussianRadialBasis
 from diffusion_edf.irreps_utils import cutoff_irreps
+from diffusion_edf.connectivity import sort_edges_by_dst, edge_vec_and_length
 
 
 class GraphEdgeEncoderBase(torch.nn.Module):
@@ -129,10 +130,13 @@ class GraphEdgeEncoderBase(torch.nn.Module):
             self.irreps_sh = None
             self.sh_dim = None
             self.sh = None
+            self.register_buffer('sh_scalar_mask', None, persistent=False)
         else:
             self.irreps_sh = o3.Irreps(irreps_sh)
             self.sh_dim = self.irreps_sh.dim
-            self.sh = o3.SphericalHarmonics(irreps_out = self.irreps_sh, normalize = True, normalization='component')
+            self.sh = o3.SphericalHarmonics(irreps_out = self.irreps_sh, normalize = False, normalization='component') # Edge vectors are normalized by edge_vec_and_length
+            sh_scalar_mask = torch.cat([torch.full((mul*ir.dim,), ir.l == 0, dtype=torch.bool) for mul, ir in self.irreps_sh])
+            self.register_buffer('sh_scalar_mask', sh_scalar_mask, persistent=False) # (sh_dim, ) True for l=0 components
         
         ##################################
         if requires_length is False and requires_length != self.requires_length:
@@ -156,8 +160,7 @@ class GraphEdgeEncoderBase(torch.nn.Module):
         assert edge_src.ndim == 1
         assert edge_dst.ndim == 1
 
-        edge_vec = x_src.index_select(0, edge_src) - x_dst.index_select(0, edge_dst) # (Nedge, 3)
-        edge_length = edge_vec.norm(dim=1, p=2)                                      # (Nedge, )
+        edge_vec, edge_length = edge_vec_and_length(x_src, x_dst, edge_src, edge_dst, normalize=True) # (Nedge, 3), (Nedge, )
 
         offset = self.offset
         if offset is not None:
@@ -189,13 +192,15 @@ class GraphEdgeEncoderBase(torch.nn.Module):
                                         edge_cutoff=edge_cutoff,
                                         cutoff_scalar=None, 
                                         cutoff_nonscalar=cutoff_nonscalar,
-                                        irreps=self.irreps_sh)
+                                        irreps=self.irreps_sh,
+                                        scalar_mask=self.sh_scalar_mask)
             else:
                 edge_sh = cutoff_irreps(f=edge_sh, 
                                         edge_cutoff=None,
                                         cutoff_scalar=None, 
                                         cutoff_nonscalar=cutoff_nonscalar,
-                                        irreps=self.irreps_sh)
+                                        irreps=self.irreps_sh,
+                                        scalar_mask=self.sh_scalar_mask)
                 
         if edge_cutoff is None:
             if fill_edge_weights is None:
@@ -276,7 +281,7 @@ class InfiniteBipartite(GraphEdgeEncoderBase):
         assert src.x.ndim == 2
         assert dst.x.ndim == 2
 
-        edge_src, edge_dst = torch.meshgrid(torch.arange(len(src.x), device = src.x.device), torch.arange(len(dst.x), device = dst.x.device), indexing='ij')
+        edge_dst, edge_src = torch.meshgrid(torch.arange(len(dst.x), device = dst.x.device), torch.arange(len(src.x), device = src.x.device), indexing='ij') # Sorted by edge_dst (primary) and edge_src (secondary)
         edge_src = edge_src.reshape(-1)
         edge_dst = edge_dst.reshape(-1)
 
@@ -338,6 +343,7 @@ class RadiusBipartite(GraphEdgeEncoderBase):
         assert dst.x.ndim == 2
         edge = radius(x = src.x, y = dst.x, r=self.r_cluster, batch_x=src.b, batch_y=dst.b, max_num_neighbors=max_neighbors)
         edge_dst, edge_src = edge[0], edge[1]
+        edge_src, edge_dst = sort_edges_by_dst(edge_src=edge_src, edge_dst=edge_dst, n_src=len(src.x))
 
         if not self.requires_encoding:
             return GraphEdge(edge_src=edge_src, edge_dst=edge_dst)
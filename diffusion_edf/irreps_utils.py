@@ -22,10 +22,43 @@ def cutoff_irreps(f: torch.Tensor,
                   cutoff_scalar: Optional[torch.Tensor], 
                   cutoff_nonscalar: Optional[torch.Tensor], 
                   irreps: List[Tuple[int, Tuple[int, int]]],
-                  log: bool = False) -> torch.Tensor:
+                  log: bool = False,
+                  scalar_mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+    """
+    scalar_mask: (Optional) bool tensor of shape (irreps.dim,) that is True for the l=0 components of f.
+                 If provided, scalar/nonscalar cutoffs are applied with a single broadcasted multiply over the contiguous f,
+                 instead of slicing every irrep and concatenating them back.
+    """
     if edge_cutoff is None and cutoff_scalar is None and cutoff_nonscalar is None:
         return f
     
+    if scalar_mask is not None:
+        if cutoff_scalar is None and cutoff_nonscalar is None:
+            f_cutoff = f
+        else:
+            one = torch.ones(1, dtype=f.dtype, device=f.device)
+            if cutoff_scalar is None:
+                c_scalar = one
+            elif log is True:
+                c_scalar = torch.exp(cutoff_scalar[..., None])
+            else:
+                c_scalar = cutoff_scalar[..., None]
+            if cutoff_nonscalar is None:
+                c_nonscalar = one
+            elif log is True:
+                c_nonscalar = torch.exp(cutoff_nonscalar[..., None])
+            else:
+                c_nonscalar = cutoff_nonscalar[..., None]
+            f_cutoff = f * torch.where(scalar_mask, c_scalar, c_nonscalar)
+
+        if edge_cutoff is not None:
+            if log is True:
+                f_cutoff = f_cutoff * torch.exp(edge_cutoff[..., None])
+            else:
+                f_cutoff = f_cutoff * edge_cutoff[..., None]
+
+        return f_cutoff
+
     f_cutoff = []
     last_idx = 0
     for n, (l,p) in irreps:
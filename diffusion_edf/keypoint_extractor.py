@@ -1,7 +1,4 @@
 from typing import List, Optional, Union, Tuple, Iterable, Callable, Dict
-import math
-import warnings
-from tqdm import tqdm
 from beartype import beartype
 
 import torch
@@ -10,13 +7,12 @@ from e3nn import o3
 from torch_cluster import fps
 
 
-from diffusion_edf import transforms
-from diffusion_edf.equiformer.graph_attention_transformer import SeparableFCTP
 from diffusion_edf.unet_feature_extractor import UnetFeatureExtractor
 from diffusion_edf.forward_only_feature_extractor import ForwardOnlyFeatureExtractor
 from diffusion_edf.multiscale_tensor_field import MultiscaleTensorField
-from diffusion_edf.gnn_data import FeaturedPoints, TransformPcd, set_featured_points_attribute, flatten_featured_points, detach_featured_points
-from diffusion_edf.radial_func import SinusoidalPositionEmbeddings
+from diffusion_edf.gnn_data import FeaturedPoints, set_featured_points_attribute
+from diffusion_edf.utils import sorted_scatter_softmax, scatter_entmax15, compile_forward, use_pt2_e3nn_defaults, restore_e3nn_defaults
+from diffusion_edf.connectivity import fps_fixed
 
 
 class StaticKeypointModel(torch.nn.Module):
@@ -52,6 +48,7 @@ class KeypointExtractor(torch.nn.Module):
     deterministic: bool
     pool_ratio: float
 
+    @restore_e3nn_defaults
     @beartype
     def __init__(self, 
                  feature_extractor_kwargs: Dict,
@@ -60,11 +57,23 @@ class KeypointExtractor(torch.nn.Module):
                  feature_extractor_name: str = 'UnetFeatureExtractor', # ForwardOnlyFeatureExtractor
                  weight_activation: str = 'sigmoid',
                  weight_mult: Optional[Union[float, int]] = None,
-                 deterministic: bool = False,):
+                 deterministic: bool = False,
+                 static_fps: bool = False,
+                 use_pt2: bool = False,
+                 bf16_weight_head: bool = False):
         super().__init__()
         self.deterministic = deterministic
+        self.static_fps: bool = static_fps # Use the pure-pytorch fps_fixed for query point sampling instead of torch_cluster.fps.
+        self.use_pt2: bool = use_pt2       # torch.compile the whole forward.
+        self.bf16_weight_head: bool = bf16_weight_head # bf16 autocast for weight_post on CUDA. Weights are returned in the input feature dtype.
+        if self.use_pt2:
+            use_pt2_e3nn_defaults()
         self.pool_ratio = float(keypoint_kwargs['pool_ratio'])
         self.keypoint_bbox: Optional[List[List[float]]] = keypoint_kwargs.get('bbox', None)
+        if self.keypoint_bbox is None:
+            self.register_buffer('keypoint_bbox_tensor', None, persistent=False)
+        else:
+            self.register_buffer('keypoint_bbox_tensor', torch.tensor(self.keypoint_bbox, dtype=torch.float32), persistent=False) # (3, 2); Avoid host-to-device copy every call.
         weight_pre_emb_dim: Optional[int] = keypoint_kwargs['weight_pre_emb_dim']
         if weight_pre_emb_dim:
             pass
@@ -115,21 +124,24 @@ class KeypointExtractor(torch.nn.Module):
         #### Equivariant Weight Field ####
         tensor_field_kwargs['irreps_output'] = o3.Irreps(f"{weight_pre_emb_dim}x0e")
         self.weight_field = MultiscaleTensorField(**(tensor_field_kwargs))
+        # Scalar-only (f"{weight_pre_emb_dim}x0e") head => plain LayerNorm/Linear. Scripted so that the pointwise ops are fused. (state_dict keys are unchanged)
         self.weight_post = torch.nn.Sequential(
             torch.nn.LayerNorm(self.weight_pre_emb_dim),
             torch.nn.SiLU(inplace=True),
             torch.nn.Linear(self.weight_pre_emb_dim, 1),
             torch.nn.Sigmoid() if weight_activation == 'sigmoid' else torch.nn.Identity(),
         )
-        if weight_activation == 'sigmoid' or 'none':
-            self.weight_activation = None
-        elif weight_activation == 'softmax':
-            self.weight_activation = torch.nn.Softmax(dim=-1)
-        else:
+        if not self.use_pt2: # torch.compile fuses it anyway, and cannot trace into ScriptModules.
+            self.weight_post = torch.jit.script(self.weight_post)
+        if weight_activation not in ['sigmoid', 'none', 'softmax', 'entmax15']:
             raise ValueError(f"Unknown weight activation: {weight_activation}")
+        self.weight_activation: str = weight_activation # 'sigmoid' is applied inside weight_post.
 
         self.irreps_output = o3.Irreps(self.tensor_field.irreps_output)
 
+        if self.use_pt2:
+            compile_forward(self, dynamic=True)
+
     def init_query_points(self, src_points: FeaturedPoints, 
                        retain_feature: bool = False,
                        retain_weight: bool = False) -> FeaturedPoints:
@@ -140,19 +152,26 @@ class KeypointExtractor(torch.nn.Module):
         w = src_points.w
         
         
-        if self.keypoint_bbox is not None:
-            keypoint_bbox = torch.tensor(self.keypoint_bbox, dtype=x.dtype, device=x.device)
-            inrange_idx = ((x >= keypoint_bbox[:,0]) * (x <= keypoint_bbox[:,1])).all(dim=-1).nonzero().squeeze()
-            x = x.index_select(index=inrange_idx, dim=0)
-            f = f.index_select(index=inrange_idx, dim=0)
-            b = b.index_select(index=inrange_idx, dim=0)
+        keypoint_bbox = self.keypoint_bbox_tensor
+        if keypoint_bbox is not None:
+            keypoint_bbox = keypoint_bbox.to(dtype=x.dtype)
+            inrange_mask = ((x >= keypoint_bbox[:,0]) & (x <= keypoint_bbox[:,1])).all(dim=-1) # (N, )
+            x = x[inrange_mask]
+            f = f[inrange_mask]
+            b = b[inrange_mask]
             if w is not None:
-                w = w.index_select(index=inrange_idx, dim=0)
+                w = w[inrange_mask]
 
-        node_dst_idx = fps(src=x.detach(), 
-                           batch=b.detach(), 
-                           ratio=self.pool_ratio, 
-                           random_start=not self.deterministic)
+        if self.static_fps:
+            node_dst_idx = fps_fixed(src=x.detach(), 
+                                     batch=b.detach(), 
+                                     ratio=self.pool_ratio, 
+                                     random_start=not self.deterministic)
+        else:
+            node_dst_idx = fps(src=x.detach(), 
+                               batch=b.detach(), 
+                               ratio=self.pool_ratio, 
+                               random_start=not self.deterministic)
         
 
         if retain_feature:
@@ -187,9 +206,18 @@ class KeypointExtractor(torch.nn.Module):
                                     input_points_multiscale = output_points_multiscale,
                                     context_emb = None,
                                     max_neighbors = max_neighbors).f # Features: (nQ, wEmb)
-        weights = self.weight_post(weights).squeeze(-1) # Features: (nQ, )
-        if self.weight_activation is not None:
-            weights = self.weight_activation(weights)
+        if self.bf16_weight_head and weights.is_cuda:
+            feature_dtype = weights.dtype
+            with torch.autocast(device_type='cuda', dtype=torch.bfloat16):
+                weights = self.weight_post(weights)
+            weights = weights.to(dtype=feature_dtype)
+        else:
+            weights = self.weight_post(weights)
+        weights = weights.squeeze(-1) # Features: (nQ, )
+        if self.weight_activation == 'softmax':
+            weights = sorted_scatter_softmax(weights, query_points.b) # Normalized within each batch; fps returns query points sorted by batch.
+        elif self.weight_activation == 'entmax15':
+            weights = scatter_entmax15(weights, query_points.b) # Sparse weights (exact zeros), normalized within each batch.
         if self.weight_mult_logit is not None:
             weights = weights * F.softplus(self.weight_mult_logit)
 
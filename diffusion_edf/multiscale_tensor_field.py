@@ -5,11 +5,13 @@ from beartype import beartype
 
 import torch
 from e3nn import o3
+from torch_scatter import scatter_add
 
 
 from diffusion_edf.gnn_block import EquiformerBlock
 from diffusion_edf.utils import multiply_irreps
-from diffusion_edf.gnn_data import FeaturedPoints, GraphEdge, set_graph_edge_attribute, cat_graph_edges, cat_featured_points
+from diffusion_edf.gnn_data import FeaturedPoints, GraphEdge, set_graph_edge_attribute, cat_graph_edges_list, cat_featured_points_list, permute_graph_edges
+from diffusion_edf.connectivity import degree_to_rowptr
 from diffusion_edf.graph_parser import RadiusBipartite, InfiniteBipartite
 
 
@@ -192,7 +194,13 @@ class MultiscaleTensorField(torch.nn.Module):
     def forward(self, query_points: FeaturedPoints,
                 input_points_multiscale: List[FeaturedPoints],
                 context_emb: Optional[List[torch.Tensor]] = None,
-                max_neighbors: int = 1000) -> FeaturedPoints:
+                max_neighbors: int = 1000,
+                n_queries_per_context: int = 1) -> FeaturedPoints:
+        """
+        n_queries_per_context: Number of consecutive query points that share the same row of context_emb[n].
+                               For example, context_emb[n] of shape (nT, cEmb) with query points flattened from (nT, nQ) => n_queries_per_context = nQ.
+                               This avoids materializing (nT*nQ, cEmb) context embeddings; rows are gathered per edge directly.
+        """
         assert len(input_points_multiscale) == self.n_scales
         assert query_points.x.ndim == 2 # (Nq, 3)
         if self.context_emb_dim is not None:
@@ -203,13 +211,16 @@ class MultiscaleTensorField(torch.nn.Module):
             assert context_emb is None
 
         n_total_points: int = 0
-        graph_edges_flattend: Optional[GraphEdge] = None
-        input_points_flattend: Optional[FeaturedPoints] = None
+        graph_edges_multiscale: List[GraphEdge] = []
+        input_points_list: List[FeaturedPoints] = []
+        # TorchScript unrolls iteration over ModuleLists at compile time (one copy of the body per scale), so no codegen is needed here.
         for n, (graph_parser, edge_scalars_pre_linear) in enumerate(zip(self.graph_parsers, self.edge_scalars_pre_linears)):
             input_points: FeaturedPoints = input_points_multiscale[n]
             assert input_points.x.ndim == 2 and input_points.x.shape[-1] == 3, f"{input_points.x.shape}"
 
             ### Parse Graph ###
+            # One radius search per scale on purpose: a single search with the largest cutoff would return every coarse-scale neighbor at the finest (densest) scale too,
+            # and max_neighbors truncation would then drop in-range edges differently from the per-scale searches.
             graph_edge: GraphEdge = graph_parser(src=input_points, dst=query_points, max_neighbors=max_neighbors)
 
             ### Encode length and context embeddings ###
@@ -222,9 +233,13 @@ class MultiscaleTensorField(torch.nn.Module):
                 # assert self.context_emb_dim == context_emb.shape[-1], f"{self.context_emb_dim} != {context_emb.shape[-1]} of {context_emb.shape}"
                 # context_emb = context_emb.index_select(0, graph_edge.edge_dst)            # (nEdge, cEmb)
                 # edge_scalars = torch.cat([edge_scalars, context_emb], dim=-1)  # (nEdge, Emb = lEmb + cEmb)
+                if n_queries_per_context == 1:
+                    edge_context_idx = graph_edge.edge_dst
+                else:
+                    edge_context_idx = torch.div(graph_edge.edge_dst, n_queries_per_context, rounding_mode='floor')
                 edge_scalars = torch.cat([
                     edge_scalars, 
-                    context_emb[n].index_select(0, graph_edge.edge_dst)
+                    context_emb[n].index_select(0, edge_context_idx)
                 ], dim=-1) # (nEdge, Emb = lEmb + cEmb)
                 # edge_scalars = edge_scalars.type(torch.float32) # To avoid JIT type bug
                 edge_scalars = edge_scalars.type(edge_scalars_pre_linear[0].weight.dtype) # To avoid JIT type bug
@@ -237,25 +252,32 @@ class MultiscaleTensorField(torch.nn.Module):
                                                   edge_scalars=edge_scalars, 
                                                   edge_src = graph_edge.edge_src + n_total_points)
             n_total_points = n_total_points + len(input_points.x)
-            if n == 0:
-                assert graph_edges_flattend is None and input_points_flattend is None
-                graph_edges_flattend = graph_edge
-                input_points_flattend = input_points
-            else:
-                assert graph_edges_flattend is not None and input_points_flattend is not None
-                graph_edges_flattend = cat_graph_edges(graph_edges_flattend, graph_edge)
-                input_points_flattend = cat_featured_points(input_points_flattend, input_points)
+            graph_edges_multiscale.append(graph_edge)
+            input_points_list.append(input_points)
+
+        # Concatenate all scales at once instead of re-copying the accumulated tensors at every scale.
+        graph_edges_flattend: GraphEdge = cat_graph_edges_list(graph_edges_multiscale)
+        input_points_flattend: FeaturedPoints = cat_featured_points_list(input_points_list)
 
         if len(graph_edges_flattend.edge_src) == 0:
             warnings.warn("Multiscale Tensor Field: zero edges detected!")
 
+        ### Sort edges by destination for CSR segment reduction ###
+        if self.n_scales > 1: # Graph parsers already return sorted edges, so only the concatenated multiscale graph has to be re-sorted.
+            perm = torch.argsort(graph_edges_flattend.edge_dst * n_total_points + graph_edges_flattend.edge_src)
+            graph_edges_flattend = permute_graph_edges(graph_edge=graph_edges_flattend, perm=perm)
+        degree = scatter_add(src=torch.ones_like(graph_edges_flattend.edge_dst), index=graph_edges_flattend.edge_dst, dim=0, dim_size=len(query_points.x))
+        rowptr = degree_to_rowptr(degree) # (Nq+1, )
+
         output_points: FeaturedPoints = self.gnn_block_init(src_points=input_points_flattend,
                                                             dst_points=query_points,
-                                                            graph_edge=graph_edges_flattend)
+                                                            graph_edge=graph_edges_flattend,
+                                                            rowptr=rowptr)
         for block in self.gnn_blocks:
             output_points: FeaturedPoints = block(src_points=input_points_flattend,
                                                   dst_points=output_points,
-                                                  graph_edge=graph_edges_flattend)
+                                                  graph_edge=graph_edges_flattend,
+                                                  rowptr=rowptr)
         
         return output_points
         
\ No newline at end of file
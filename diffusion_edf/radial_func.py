@@ -27,6 +27,26 @@ def soft_square_cutoff(x, thr:float = 0.8, n:int = 3, infinite: bool = False) ->
         return soft_cutoff(x, thr=thr, n=n) * (x > 0.5) + soft_cutoff(1-x, thr=thr, n=n) * (x <= 0.5)
     else:
         return (x > 0.5) + soft_cutoff(1-x, thr=thr, n=n) * (x <= 0.5)
+
+@torch.jit.script
+def fused_gaussian_rbf(dist: torch.Tensor, mean: torch.Tensor, std: torch.Tensor, weight: torch.Tensor, offset: float, cutoff: float) -> torch.Tensor:
+    x = ((dist - offset) / (cutoff - offset)).unsqueeze(-1)                 # (nEdge, 1)
+    return weight * torch.exp(-0.5 * torch.pow((x - mean) / std, 2))       # (nEdge, num_basis)
+
+@torch.jit.script
+def fused_gaussian_rbf_cutoff(dist: torch.Tensor, mean: torch.Tensor, std: torch.Tensor, weight: torch.Tensor, offset: float, cutoff: float, thr: float = 0.8, n: int = 3, infinite: bool = False) -> torch.Tensor:
+    """
+    Branchless equivalent of gaussian(...) * soft_square_cutoff(...), written as a single pointwise expression so that the fuser emits one kernel.
+    """
+    x = ((dist - offset) / (cutoff - offset)).unsqueeze(-1)                 # (nEdge, 1)
+    y = weight * torch.exp(-0.5 * torch.pow((x - mean) / std, 2))          # (nEdge, num_basis)
+
+    u_l = (x - thr) / (1 - thr)                                             # soft_cutoff(x)
+    u_r = (1 - x - thr) / (1 - thr)                                         # soft_cutoff(1-x)
+    step_l = (u_l>0) * ((u_l<1)*((n+1)*u_l.pow(n)-n*u_l.pow(n+1)) + (u_l>=1))
+    step_r = (u_r>0) * ((u_r<1)*((n+1)*u_r.pow(n)-n*u_r.pow(n+1)) + (u_r>=1))
+    cutoff_val = (x > 0.5) * (1 - float(infinite) * step_l) + (x <= 0.5) * (1 - step_r)
+    return y * cutoff_val
     
 @torch.jit.script
 def soft_square_cutoff_2(x: torch.Tensor, ranges: Optional[Tuple[Optional[float], Optional[float], Optional[float], Optional[float]]], n:int = 3) -> torch.Tensor:
@@ -257,25 +277,20 @@ class GaussianRadialBasisLayerFiniteCutoff(torch.nn.Module):
         self.cutoff_thr_ratio: float = cutoff_thr_ratio
         assert cutoff_thr_ratio <= 0.95
 
-        self.normalizer = math.sqrt(self.num_basis)
-        self.infinite = infinite
+        self.normalizer: float = math.sqrt(self.num_basis)
+        self.infinite: bool = infinite
         
 
     def forward(self, dist: torch.Tensor) -> torch.Tensor:
-        dist = (dist - self.offset) / (self.cutoff - self.offset)
-        dist = dist.unsqueeze(-1)
-
-        
-        x = dist.expand(-1, self.num_basis)
-        mean = self.mean
-        std = F.softplus(self.std_logit) + 1e-5
-        x = gaussian(x, mean, std)
-        x = torch.sigmoid(self.weight_logit) * self.max_weight * x
+        std = F.softplus(self.std_logit) + 1e-5                                       # (1, num_basis)
+        weight = torch.sigmoid(self.weight_logit) * (self.max_weight * self.normalizer) # (1, num_basis)
 
         if self.soft_cutoff is True:
-            x = x * soft_square_cutoff(dist, thr=self.cutoff_thr_ratio, infinite=self.infinite)
-        
-        return x * self.normalizer
+            return fused_gaussian_rbf_cutoff(dist, self.mean, std, weight, 
+                                             offset=self.offset, cutoff=self.cutoff, 
+                                             thr=self.cutoff_thr_ratio, infinite=self.infinite)
+        else:
+            return fused_gaussian_rbf(dist, self.mean, std, weight, offset=self.offset, cutoff=self.cutoff)
     
     
     # def extra_repr(self):
@@ -283,6 +298,19 @@ class GaussianRadialBasisLayerFiniteCutoff(torch.nn.Module):
     #         self.mean_init_max, self.mean_init_min, self.std_init_max, self.std_init_min)
 
 
+class StackedGaussianRadialBasisLayerFiniteCutoff(GaussianRadialBasisLayerFiniteCutoff):
+    """
+    n_stack independent GaussianRadialBasisLayerFiniteCutoff with the same num_basis and cutoff, evaluated on the same edges in a single call.
+    Output shape: (n_stack, nEdge, num_basis)
+    """
+    def __init__(self, n_stack: int, num_basis: int, cutoff: float, soft_cutoff: bool = True, offset: Optional[float] = None, cutoff_thr_ratio: float = 0.8, infinite: bool = False):
+        super().__init__(num_basis=num_basis, cutoff=cutoff, soft_cutoff=soft_cutoff, offset=offset, cutoff_thr_ratio=cutoff_thr_ratio, infinite=infinite)
+        self.n_stack: int = n_stack
+        self.mean = torch.nn.Parameter(self.mean.detach().unsqueeze(0).repeat(n_stack, 1, 1))               # (n_stack, 1, num_basis)
+        self.std_logit = torch.nn.Parameter(self.std_logit.detach().unsqueeze(0).repeat(n_stack, 1, 1))     # (n_stack, 1, num_basis)
+        self.weight_logit = torch.nn.Parameter(self.weight_logit.detach().unsqueeze(0).repeat(n_stack, 1, 1)) # (n_stack, 1, num_basis)
+
+
 
 
 
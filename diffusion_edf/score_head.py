@@ -160,7 +160,7 @@ class ScoreModelHead(torch.nn.Module):
         time_enc: torch.Tensor = self.time_enc(time)                       # (nT, time_emb_mlp[0])
         for time_mlp in self.time_mlps_multiscale:
             time_embs_multiscale.append(
-                time_mlp(time_enc).unsqueeze(-2).expand(-1, nQ, -1).reshape(nT*nQ, self.time_emb_dim)        # (nT, time_emb_D) -> # (nT*nQ, time_emb_D)
+                time_mlp(time_enc)        # (nT, time_emb_D); Shared by nQ consecutive query points (n_queries_per_context = nQ)
             )        
 
         ################# TODO: SCRUTINIZE THIS CODE ########################
@@ -178,7 +178,8 @@ class ScoreModelHead(torch.nn.Module):
         if self.edge_time_encoding:
             query_transformed = self.key_tensor_field(query_points = query_transformed, 
                                                                       input_points_multiscale = key_pcd_multiscale,
-                                                                      context_emb = time_embs_multiscale)                      # (nT*nQ, 3), (nT*nQ, F), (nT*nQ,), (nT*nQ,)
+                                                                      context_emb = time_embs_multiscale,
+                                                                      n_queries_per_context = nQ)                              # (nT*nQ, 3), (nT*nQ, F), (nT*nQ,), (nT*nQ,)
         else:
             assert self.query_time_encoding is True, f"You need to use at least one (query or edge) time encoding method."
             query_transformed = self.key_tensor_field(query_points = query_transformed, 
@@ -10,26 +10,44 @@ from diffusion_edf.equiformer.layer_norm import EquivariantLayerNormV2
 
 
 #@compile_mode('script')
-class ProjectIfMismatch(torch.nn.Module):
+class IdentitySkip(torch.nn.Module):
+    def __init__(self, irreps: o3.Irreps):
+        super().__init__()
+        self.irreps_in = o3.Irreps(irreps)
+        self.irreps_out = o3.Irreps(irreps)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return x
+
+
+#@compile_mode('script')
+class ProjectSkip(torch.nn.Module):
     def __init__(self, irreps_in: o3.Irreps, irreps_out: o3.Irreps, bias: bool = True, layernorm: bool = True):
         super().__init__()
         self.irreps_in = o3.Irreps(irreps_in)
         self.irreps_out = o3.Irreps(irreps_out)
-        if self.irreps_in == self.irreps_out:
-            self.skip = torch.nn.Identity()
-            self.layernorm = torch.nn.Identity()
+        if layernorm:
+            self.layernorm = EquivariantLayerNormV2(self.irreps_in)
         else:
-            if layernorm:
-                self.layernorm = EquivariantLayerNormV2(self.irreps_in)
-            else:
-                self.layernorm = torch.nn.Identity()
-            self.skip = LinearRS(irreps_in=self.irreps_in,
-                                 irreps_out=self.irreps_out,
-                                 bias=bias,
-                                 rescale=True)
-            
+            self.layernorm = None
+        self.skip = LinearRS(irreps_in=self.irreps_in,
+                             irreps_out=self.irreps_out,
+                             bias=bias,
+                             rescale=True)
 
     def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = self.layernorm(x)
+        if self.layernorm is not None:
+            x = self.layernorm(x)
         x = self.skip(x)
-        return x
\ No newline at end of file
+        return x
+
+
+def ProjectIfMismatch(irreps_in: o3.Irreps, irreps_out: o3.Irreps, bias: bool = True, layernorm: bool = True) -> torch.nn.Module:
+    """
+    Returns IdentitySkip if irreps_in == irreps_out, else ProjectSkip (optional EquivariantLayerNormV2 + LinearRS).
+    The variant is chosen at construction so that the forward of each is free of no-op submodule calls. (state_dict keys are the same as before)
+    """
+    if o3.Irreps(irreps_in) == o3.Irreps(irreps_out):
+        return IdentitySkip(irreps=irreps_in)
+    else:
+        return ProjectSkip(irreps_in=irreps_in, irreps_out=irreps_out, bias=bias, layernorm=layernorm)
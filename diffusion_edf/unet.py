@@ -15,7 +15,7 @@ from diffusion_edf.equiformer.tensor_product_rescale import LinearRS
 from diffusion_edf import EXTRACTOR_INFO_TYPE, GNN_OUTPUT_TYPE, QUERY_TYPE, EDF_INFO_TYPE
 from diffusion_edf.embedding import NodeEmbeddingNetwork
 from diffusion_edf.block import EquiformerBlock
-from diffusion_edf.connectivity import FpsPool, RadiusGraph, RadiusConnect
+from diffusion_edf.connectivity import FpsPool, RadiusGraph, RadiusConnect, edge_vec_and_length
 from diffusion_edf.radial_func import GaussianRadialBasisLayerFiniteCutoff
 from diffusion_edf.utils import multiply_irreps, ParityInversionSh
 from diffusion_edf.skip import ProjectIfMismatch
@@ -112,7 +112,7 @@ class EdfUnet(torch.nn.Module):
             else:
                 raise NotImplementedError
             block['radius_graph'] = RadiusGraph(r=self.radius[n], max_num_neighbors=1000)
-            block['spherical_harmonics'] = o3.SphericalHarmonics(irreps_out = self.irreps_edge_attr[n], normalize = True, normalization='component')
+            block['spherical_harmonics'] = o3.SphericalHarmonics(irreps_out = self.irreps_edge_attr[n], normalize = False, normalization='component') # Edge vectors are normalized by edge_vec_and_length
 
             pool_layer = torch.nn.ModuleDict()
             pool_layer['radial'] = GaussianRadialBasisLayerFiniteCutoff(num_basis=self.fc_neurons[n][0], cutoff=0.99 * self.radius[n])
@@ -252,10 +252,9 @@ class EdfUnet(torch.nn.Module):
             pool_graph = block['pool'](node_coord_src = node_coord, 
                                        node_feature_src = node_feature, 
                                        batch_src = batch)
-            node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst = pool_graph
+            node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst, rowptr = pool_graph
             node_feature_dst = block['pool_proj'](node_feature_dst)
-            edge_vec: torch.Tensor = node_coord.index_select(0, edge_src) - node_coord_dst.index_select(0, edge_dst)
-            edge_length = edge_vec.norm(dim=1, p=2)
+            edge_vec, edge_length = edge_vec_and_length(node_coord, node_coord_dst, edge_src, edge_dst, normalize=True)
             edge_attr = block['spherical_harmonics'](edge_vec)
 
             edge_scalars = block['pool_layer']['radial'](edge_length)
@@ -265,7 +264,8 @@ class EdfUnet(torch.nn.Module):
                                                           edge_src = edge_src,
                                                           edge_dst = edge_dst,
                                                           edge_attr = edge_attr,
-                                                          edge_scalars = edge_scalars)
+                                                          edge_scalars = edge_scalars,
+                                                          rowptr = rowptr)
             
 
             node_feature = node_feature_dst
@@ -278,9 +278,8 @@ class EdfUnet(torch.nn.Module):
             radius_graph = block['radius_graph'](node_coord_src = node_coord, 
                                                  node_feature_src = node_feature, 
                                                  batch_src = batch)
-            node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst = radius_graph
-            edge_vec: torch.Tensor = node_coord.index_select(0, edge_src) - node_coord_dst.index_select(0, edge_dst)
-            edge_length = edge_vec.norm(dim=1, p=2)
+            node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst, rowptr = radius_graph
+            edge_vec, edge_length = edge_vec_and_length(node_coord, node_coord_dst, edge_src, edge_dst, normalize=True)
             edge_attr = block['spherical_harmonics'](edge_vec)
 
             for i, layer in enumerate(block['layer_stack']):
@@ -291,7 +290,8 @@ class EdfUnet(torch.nn.Module):
                                                 edge_src = edge_src,
                                                 edge_dst = edge_dst,
                                                 edge_attr = edge_attr,
-                                                edge_scalars = edge_scalars)
+                                                edge_scalars = edge_scalars,
+                                                rowptr = rowptr)
 
 
                 node_feature = node_feature_dst
@@ -311,7 +311,8 @@ class EdfUnet(torch.nn.Module):
                                             edge_src = edge_src,
                                             edge_dst = edge_dst,
                                             edge_attr = edge_attr,
-                                            edge_scalars = edge_scalars)
+                                            edge_scalars = edge_scalars,
+                                            rowptr = rowptr)
             node_feature = node_feature_dst
             node_coord = node_coord_dst
             batch = batch_dst
@@ -551,27 +552,6 @@ class EDF(torch.nn.Module):
                                                                                     node_coord=node_coord,
                                                                                     batch=batch)
         return node_feature, node_coord, batch, scale_slice, edge_src, edge_dst
-    
-    # def _reshape_extractor_inputs(self, query_coord: torch.Tensor,
-    #                               query_batch: torch.Tensor,
-    #                               gnn_outputs: Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
-        
-    #     assert query_coord.ndim == 2 and query_coord.shape[-1] == 3 and query_batch.ndim == 1
-    #     Nq = len(query_coord)
-    #     query_coord = query_coord.expand(self.n_scales, Nq, 3) # (Ns, Nq, 3)
-    #     query_scale = torch.arange(self.n_scales, dtype=query_batch.dtype, device=query_batch.device)
-    #     query_batch_n_scale = query_batch * query_scale.unsqueeze(-1) + query_scale.unsqueeze(-1) # (Ns, Nq)
-
-    #     node_feature, node_coord, batch, scale, edge_src, edge_dst = gnn_outputs
-    #     node_batch_n_scale = batch * scale + scale
-
-    #     return query_coord, query_batch_n_scale, node_feature, node_coord, node_batch_n_scale
-    
-    # def get_scale_node(self, node_coord, node_batch_n_scale, n):
-    #     this_scale_node_idx = (node_batch_n_scale % self.n_scales == n).nonzero().squeeze(-1)
-    #     node_coord_this_scale = torch.index_select(node_coord, dim=-2, index = this_scale_node_idx)
-    #     batch_this_scale = torch.index_select(node_batch_n_scale, dim=-1, index = this_scale_node_idx) // self.n_scales
-            
 
     def forward(self, query_coord: torch.Tensor,
                 query_batch: torch.Tensor,
@@ -592,15 +572,14 @@ class EDF(torch.nn.Module):
         if info_mode == 'NONE':
             edf_info = None
         elif info_mode == 'NO_GRAD' or info_mode == 'REQUIRES_GRAD':
-            (edge_src_field, edge_dst_field) = extractor_info
             if info_mode == 'NO_GRAD':
+                # Only the float tensors can carry gradients; batch and edge indices (incl. extractor_info) are integer tensors and are passed as-is.
                 gnn_outputs = (node_feature.detach(), 
                             node_coord.detach(), 
-                            batch.detach(),
+                            batch,
                             scale_slice,
-                            edge_src.detach(), 
-                            edge_dst.detach())
-                extractor_info = (edge_src_field.detach(), edge_dst_field.detach())
+                            edge_src, 
+                            edge_dst)
             edf_info = (extractor_info, gnn_outputs)
         else:
             raise ValueError(f"Unknown info_mode: {info_mode}")
@@ -11,12 +11,13 @@ from torch_scatter import scatter_log_softmax
 from diffusion_edf.equiformer.tensor_product_rescale import LinearRS
 from diffusion_edf.gnn_data import FeaturedPoints
 from diffusion_edf.block import EquiformerBlock
-from diffusion_edf.connectivity import FpsPool, RadiusGraph, RadiusConnect
-from diffusion_edf.radial_func import GaussianRadialBasisLayerFiniteCutoff
-from diffusion_edf.utils import multiply_irreps, ParityInversionSh
+from diffusion_edf.connectivity import FpsPool, RadiusGraph, RadiusConnect, edge_vec_and_length
+from diffusion_edf.radial_func import GaussianRadialBasisLayerFiniteCutoff, StackedGaussianRadialBasisLayerFiniteCutoff
+from diffusion_edf.utils import multiply_irreps, ParityInversionSh, compile_forward, use_pt2_e3nn_defaults, restore_e3nn_defaults
 from diffusion_edf.skip import ProjectIfMismatch
 
 class UnetFeatureExtractor(torch.nn.Module):
+    @restore_e3nn_defaults
     @beartype
     def __init__(self,
         irreps_input: Optional[Union[str, o3.Irreps]],
@@ -43,7 +44,13 @@ class UnetFeatureExtractor(torch.nn.Module):
         drop_path_rate: Union[float, List[float]] = 0.0,
         n_layers_midstream: int = 2,
         n_scales: Optional[int] = None,
-        output_scalespace: Optional[List[int]] = None):
+        output_scalespace: Optional[List[int]] = None,
+        share_radial: bool = False,
+        shared_src_dst: bool = False,
+        use_pt2: bool = False,
+        stack_radial: bool = False,
+        bf16: bool = False,
+        bucket_fps: bool = False):
 
         self.log_num_points = math.log(10)
         
@@ -58,6 +65,15 @@ class UnetFeatureExtractor(torch.nn.Module):
         self.n_layers: List[int] = n_layers
         self.deterministic: bool = deterministic
         self.n_layers_midstream: int = n_layers_midstream
+        self.share_radial: bool = share_radial # Use a single radial basis for the layers that share the same radius graph.
+        self.shared_src_dst: bool = shared_src_dst # Fuse src/dst projections of self-attention layers into a single LinearRS.
+        self.use_pt2: bool = use_pt2               # torch.compile the gnn layers. TorchScript export of this module is not possible then.
+        self.stack_radial: bool = stack_radial     # Evaluate the radial bases of the layers that share the same radius graph in a single call.
+        assert not (self.share_radial and self.stack_radial), "share_radial and stack_radial are mutually exclusive."
+        self.bf16: bool = bf16                     # bf16 autocast for the gnn layers on CUDA.
+        self.bucket_fps: bool = bucket_fps         # fpsample-based fps pooling for CPU inputs (see FpsPool).
+        if self.use_pt2:
+            use_pt2_e3nn_defaults()
 
         if irreps_input is None:
             self.irreps_input: o3.Irreps = self.irreps_emb[0]
@@ -138,12 +154,12 @@ class UnetFeatureExtractor(torch.nn.Module):
         for n in range(self.n_scales):
             block = torch.nn.ModuleDict()
             if self.pool_method[n] == 'fps':
-                block['pool'] = FpsPool(ratio=self.pool_ratio[n], random_start=not self.deterministic, r=self.radius[n], max_num_neighbors=1000)
+                block['pool'] = FpsPool(ratio=self.pool_ratio[n], random_start=not self.deterministic, r=self.radius[n], max_num_neighbors=1000, bucket_fps=self.bucket_fps)
                 block['pool_proj'] = ProjectIfMismatch(irreps_in = self.irreps_emb[max(n-1,0)], irreps_out = self.irreps_emb[n])
             else:
                 raise NotImplementedError
             block['radius_graph'] = RadiusGraph(r=self.radius[n], max_num_neighbors=1000)
-            block['spherical_harmonics'] = o3.SphericalHarmonics(irreps_out = self.irreps_edge_attr[n], normalize = True, normalization='component')
+            block['spherical_harmonics'] = o3.SphericalHarmonics(irreps_out = self.irreps_edge_attr[n], normalize = False, normalization='component') # Edge vectors are normalized by edge_vec_and_length
 
             pool_layer = torch.nn.ModuleDict()
             pool_layer['radial'] = GaussianRadialBasisLayerFiniteCutoff(num_basis=self.fc_neurons[n][0], cutoff=0.99 * self.radius[n])
@@ -159,13 +175,19 @@ class UnetFeatureExtractor(torch.nn.Module):
                                                 proj_drop = self.proj_drop[n],
                                                 drop_path_rate = self.drop_path_rate[n],
                                                 src_bias = False,
-                                                dst_bias = True)
+                                                dst_bias = True,
+                                                bf16 = self.bf16)
             block['pool_layer'] = pool_layer
 
             layer_stack = torch.nn.ModuleList()
+            if self.stack_radial:
+                block['stacked_radial'] = StackedGaussianRadialBasisLayerFiniteCutoff(n_stack=self.n_layers[n] - 1, num_basis=self.fc_neurons[n][0], cutoff=0.99 * self.radius[n])
+            if self.share_radial:
+                block['shared_radial'] = GaussianRadialBasisLayerFiniteCutoff(num_basis=self.fc_neurons[n][0], cutoff=0.99 * self.radius[n])
             for _ in range(self.n_layers[n] - 1):
                 layer = torch.nn.ModuleDict()
-                layer['radial'] = GaussianRadialBasisLayerFiniteCutoff(num_basis=self.fc_neurons[n][0], cutoff=0.99 * self.radius[n])
+                if not (self.share_radial or self.stack_radial):
+                    layer['radial'] = GaussianRadialBasisLayerFiniteCutoff(num_basis=self.fc_neurons[n][0], cutoff=0.99 * self.radius[n])
                 layer['gnn'] = EquiformerBlock(irreps_src = self.irreps_emb[n], 
                                                irreps_dst = self.irreps_emb[n], 
                                                irreps_edge_attr = self.irreps_edge_attr[n], 
@@ -178,7 +200,9 @@ class UnetFeatureExtractor(torch.nn.Module):
                                                proj_drop = self.proj_drop[n],
                                                drop_path_rate = self.drop_path_rate[n],
                                                src_bias = False,
-                                               dst_bias = True)
+                                               dst_bias = True,
+                                               shared_src_dst = self.shared_src_dst,
+                                               bf16 = self.bf16)
                 layer_stack.append(layer)
             block['layer_stack'] = layer_stack
 
@@ -187,9 +211,18 @@ class UnetFeatureExtractor(torch.nn.Module):
 
         #### Mid Block ####
         self.mid_block = torch.nn.ModuleList()
+        if self.stack_radial:
+            self.mid_stacked_radial = StackedGaussianRadialBasisLayerFiniteCutoff(n_stack=self.n_layers_midstream, num_basis=self.fc_neurons[-1][0], cutoff=0.99 * self.radius[-1])
+        else:
+            self.mid_stacked_radial = None
+        if self.share_radial:
+            self.mid_shared_radial = GaussianRadialBasisLayerFiniteCutoff(num_basis=self.fc_neurons[-1][0], cutoff=0.99 * self.radius[-1])
+        else:
+            self.mid_shared_radial = None
         for i in range(self.n_layers_midstream):
             layer = torch.nn.ModuleDict()
-            layer['radial'] = GaussianRadialBasisLayerFiniteCutoff(num_basis=self.fc_neurons[-1][0], cutoff=0.99 * self.radius[-1])
+            if not (self.share_radial or self.stack_radial):
+                layer['radial'] = GaussianRadialBasisLayerFiniteCutoff(num_basis=self.fc_neurons[-1][0], cutoff=0.99 * self.radius[-1])
             layer['gnn'] = EquiformerBlock(irreps_src = self.irreps_emb[-1], 
                                             irreps_dst = self.irreps_emb[-1], 
                                             irreps_edge_attr = self.irreps_edge_attr[-1], 
@@ -202,7 +235,9 @@ class UnetFeatureExtractor(torch.nn.Module):
                                             proj_drop = self.proj_drop[-1],
                                             drop_path_rate = self.drop_path_rate[-1],
                                             src_bias = False,
-                                            dst_bias = True)
+                                            dst_bias = True,
+                                            shared_src_dst = self.shared_src_dst,
+                                            bf16 = self.bf16)
             self.mid_block.append(layer)
 
         #### Up Block ####
@@ -227,7 +262,8 @@ class UnetFeatureExtractor(torch.nn.Module):
                                                proj_drop = self.proj_drop[n],
                                                drop_path_rate = self.drop_path_rate[n],
                                                src_bias = False,
-                                               dst_bias = True)
+                                               dst_bias = True,
+                                               bf16 = self.bf16)
                 layer_stack.append(layer)
             block['layer_stack'] = layer_stack
 
@@ -245,7 +281,8 @@ class UnetFeatureExtractor(torch.nn.Module):
                                                   proj_drop = self.proj_drop[n],
                                                   drop_path_rate = self.drop_path_rate[n],
                                                   src_bias = False,
-                                                  dst_bias = True)
+                                                  dst_bias = True,
+                                                  bf16 = self.bf16)
             block['unpool_layer'] = unpool_layer
 
 
@@ -256,6 +293,11 @@ class UnetFeatureExtractor(torch.nn.Module):
             self.project_outputs.append(ProjectIfMismatch(irreps_in=self.irreps_emb[n],
                                                           irreps_out=self.irreps_output))
 
+        if self.use_pt2:
+            for module in self.modules():
+                if isinstance(module, EquiformerBlock):
+                    compile_forward(module, dynamic=True)
+
     #@beartype
     def forward(self, pcd: FeaturedPoints) -> List[FeaturedPoints]:
 
@@ -279,10 +321,9 @@ class UnetFeatureExtractor(torch.nn.Module):
             pool_graph = block['pool'](node_coord_src = node_coord, 
                                        node_feature_src = node_feature, 
                                        batch_src = batch)
-            node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst = pool_graph
+            node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst, rowptr = pool_graph
             node_feature_dst = block['pool_proj'](node_feature_dst)
-            edge_vec: torch.Tensor = node_coord.index_select(0, edge_src) - node_coord_dst.index_select(0, edge_dst)
-            edge_length = torch.norm(edge_vec, dim=1, p=2)
+            edge_vec, edge_length = edge_vec_and_length(node_coord, node_coord_dst, edge_src, edge_dst, normalize=True)
             edge_attr = block['spherical_harmonics'](edge_vec)
 
             edge_scalars = block['pool_layer']['radial'](edge_length)
@@ -292,7 +333,8 @@ class UnetFeatureExtractor(torch.nn.Module):
                                                           edge_src = edge_src,
                                                           edge_dst = edge_dst,
                                                           edge_attr = edge_attr,
-                                                          edge_scalars = edge_scalars)
+                                                          edge_scalars = edge_scalars,
+                                                          rowptr = rowptr)
             
 
             node_feature = node_feature_dst
@@ -305,20 +347,27 @@ class UnetFeatureExtractor(torch.nn.Module):
             radius_graph = block['radius_graph'](node_coord_src = node_coord, 
                                                  node_feature_src = node_feature, 
                                                  batch_src = batch)
-            node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst = radius_graph
-            edge_vec: torch.Tensor = node_coord.index_select(0, edge_src) - node_coord_dst.index_select(0, edge_dst)
-            edge_length = edge_vec.norm(dim=1, p=2)
+            node_feature_dst, node_coord_dst, edge_src, edge_dst, degree, batch_dst, rowptr = radius_graph
+            edge_vec, edge_length = edge_vec_and_length(node_coord, node_coord_dst, edge_src, edge_dst, normalize=True)
             edge_attr = block['spherical_harmonics'](edge_vec)
 
+            if self.stack_radial:
+                edge_scalars_stack = block['stacked_radial'](edge_length) # (n_layers-1, nEdge, num_basis)
+            elif self.share_radial:
+                edge_scalars = block['shared_radial'](edge_length)        # Shared by all layers of the stack.
             for i, layer in enumerate(block['layer_stack']):
-                edge_scalars = layer['radial'](edge_length)
+                if self.stack_radial:
+                    edge_scalars = edge_scalars_stack[i]
+                elif not self.share_radial:
+                    edge_scalars = layer['radial'](edge_length)
                 node_feature_dst = layer['gnn'](node_input_src = node_feature,
                                                 node_input_dst = node_feature_dst,
                                                 batch_dst = batch_dst,
                                                 edge_src = edge_src,
                                                 edge_dst = edge_dst,
                                                 edge_attr = edge_attr,
-                                                edge_scalars = edge_scalars)
+                                                edge_scalars = edge_scalars,
+                                                rowptr = rowptr)
 
 
                 node_feature = node_feature_dst
@@ -330,15 +379,23 @@ class UnetFeatureExtractor(torch.nn.Module):
 
 
         ########### Mid Block #############
+        if self.mid_stacked_radial is not None:
+            edge_scalars_stack = self.mid_stacked_radial(edge_length) # (n_layers_midstream, nEdge, num_basis)
+        elif self.mid_shared_radial is not None:
+            edge_scalars = self.mid_shared_radial(edge_length)        # Shared by all mid layers.
         for n, layer in enumerate(self.mid_block):
-            edge_scalars = layer['radial'](edge_length)
+            if self.mid_stacked_radial is not None:
+                edge_scalars = edge_scalars_stack[n]
+            elif self.mid_shared_radial is None:
+                edge_scalars = layer['radial'](edge_length)
             node_feature_dst = layer['gnn'](node_input_src = node_feature,
                                             node_input_dst = node_feature_dst,
                                             batch_dst = batch,
                                             edge_src = edge_src,
                                             edge_dst = edge_dst,
                                             edge_attr = edge_attr,
-                                            edge_scalars = edge_scalars)
+                                            edge_scalars = edge_scalars,
+                                            rowptr = rowptr)
             node_feature = node_feature_dst
             node_coord = node_coord_dst
             batch = batch_dst
@@ -1,14 +1,61 @@
 import warnings
 from typing import Union, Optional, List, Tuple, Dict
 import math
+import functools
 
 import torch
+import e3nn
 from e3nn import o3
 from e3nn.util.jit import compile_mode
 from torch_cluster import radius
 from torch_scatter import scatter_sum
 
 from diffusion_edf.equiformer.graph_attention_transformer import sort_irreps_even_first
+from diffusion_edf.connectivity import degree_to_rowptr
+from diffusion_edf.graph_attention import segment_softmax_csr
+
+def compile_forward(module: torch.nn.Module, **kwargs) -> torch.nn.Module:
+    """
+    torch.compile module.forward in-place. Unlike torch.compile(module), parameter names (and thus state_dict keys) are left untouched.
+    Callers pass dynamic=True, as the number of points/edges varies across inputs. fps, radius and torch_scatter ops cause graph breaks, so fullgraph is not used;
+    they can be excluded from tracing with torch._dynamo.disallow_in_graph if their breaks turn out to be costly.
+    """
+    module.forward = torch.compile(module.forward, **kwargs)
+    return module
+
+def use_pt2_e3nn_defaults():
+    """
+    Call before building e3nn modules that will be torch.compile'd (use_pt2): torch.compile cannot trace the TorchScript-compiled codegen of e3nn.
+    Changes the process-wide e3nn optimization defaults; decorate the caller's __init__ with restore_e3nn_defaults so that they are always restored.
+    """
+    e3nn.set_optimization_defaults(jit_script_fx=False)
+
+def restore_e3nn_defaults(init):
+    """
+    Decorator for __init__ that restores the process-wide e3nn optimization defaults on return, even if construction fails.
+    """
+    @functools.wraps(init)
+    def wrapper(*args, **kwargs):
+        e3nn_defaults = e3nn.get_optimization_defaults()
+        try:
+            return init(*args, **kwargs)
+        finally:
+            e3nn.set_optimization_defaults(**e3nn_defaults)
+    return wrapper
+
+def to_ddp(module: torch.nn.Module, device_ids: Optional[List[int]] = None, bucket_cap_mb: int = 25) -> torch.nn.parallel.DistributedDataParallel:
+    """
+    Wrap a feature extractor / score model with DistributedDataParallel for multi-gpu training. torch.distributed must be initialized beforehand.
+    Equiformer blocks have many small parameters, so gradients are bucketed and all-reduced as views of the buckets.
+    static_graph is safe because the set of used parameters does not depend on the input (unused ones, e.g., ForwardOnlyFeatureExtractor's pool_layer['gnn'], are always unused).
+    Compose with compile_forward (use_pt2) only on torch>=2.3.
+    """
+    return torch.nn.parallel.DistributedDataParallel(module, 
+                                                     device_ids=device_ids, 
+                                                     bucket_cap_mb=bucket_cap_mb, 
+                                                     gradient_as_bucket_view=True, 
+                                                     static_graph=True, 
+                                                     find_unused_parameters=False)
 
 def multiply_irreps(irreps: Union[o3.Irreps, str], mult: int, strict: bool = True) -> o3.Irreps:
     assert isinstance(irreps, o3.Irreps) or isinstance(irreps, o3.Irreps)
@@ -22,6 +69,17 @@ def multiply_irreps(irreps: Union[o3.Irreps, str], mult: int, strict: bool = Tru
 
     return output
 
+@functools.lru_cache(maxsize=None)
+def _mlp_mid_irreps(irreps_emb: str, mult: int) -> o3.Irreps:
+    return sort_irreps_even_first((o3.Irreps(irreps_emb) * mult))[0].simplify()
+
+def mlp_mid_irreps(irreps_emb: Union[o3.Irreps, str], mult: int) -> o3.Irreps:
+    """
+    Hidden irreps of the feed-forward network: irreps_emb repeated mult times, sorted and simplified.
+    Cached on str(irreps_emb) since every block of the same scale computes the same irreps.
+    """
+    return _mlp_mid_irreps(str(o3.Irreps(irreps_emb)), mult)
+
 #@compile_mode('script')
 class ParityInversionSh(torch.nn.Module):
     def __init__(self, irreps: o3.Irreps):
@@ -66,4 +124,45 @@ class SinusoidalPositionEmbeddings(torch.nn.Module):
         embeddings = time[:, None] * embeddings[None, :]                            # shape: (nBatch, self.dim/2) 
         embeddings = torch.cat((embeddings.sin(), embeddings.cos()), dim=-1)        # shape: (nBatch, self.dim)
 
-        return embeddings
\ No newline at end of file
+        return embeddings
+
+def sorted_scatter_softmax(src: torch.Tensor, index: torch.Tensor) -> torch.Tensor:
+    """
+    Softmax of src (N, ) over the groups given by index (N, ), which must be sorted (e.g., the batch of fps outputs).
+    Thin (src, index) wrapper of segment_softmax_csr.
+    """
+    assert src.ndim == 1 and index.ndim == 1 and len(src) == len(index)
+    if len(src) == 0:
+        return src
+    return segment_softmax_csr(src, degree_to_rowptr(torch.bincount(index)))
+
+def scatter_entmax15(src: torch.Tensor, index: torch.Tensor) -> torch.Tensor:
+    """
+    1.5-entmax of src (N, ) over the groups given by index (N, ). Unlike softmax, low-scoring elements get exactly zero weight.
+    Exact sort-based threshold (Peters et al., 2019): entmax15(z)_i = max(z_i/2 - tau, 0)^2, with tau chosen such that each group sums to one.
+    """
+    assert src.ndim == 1 and index.ndim == 1 and len(src) == len(index)
+    if len(src) == 0:
+        return src
+
+    perm = torch.argsort(src, descending=True)
+    perm = perm.index_select(0, torch.argsort(index.index_select(0, perm), stable=True)) # Sort by index (primary) and -src (secondary)
+    z = src.index_select(0, perm) / 2                                                   # (N, )
+    _, seg, counts = torch.unique_consecutive(index.index_select(0, perm), return_inverse=True, return_counts=True)
+    ptr = torch.cumsum(counts, dim=0) - counts                                          # (nSeg, ) Start of each group
+    rho = (torch.arange(len(z), device=z.device) - ptr.index_select(0, seg) + 1).type(z.dtype) # (N, ) 1-based rank in group
+
+    def _segment_cumsum(x: torch.Tensor) -> torch.Tensor:
+        x_cumsum = torch.cumsum(x, dim=0)
+        return x_cumsum - (x_cumsum - x).index_select(0, ptr).index_select(0, seg)
+
+    mean = _segment_cumsum(z) / rho
+    mean_sq = _segment_cumsum(z.square()) / rho
+    delta = (1 - rho * (mean_sq - mean.square())) / rho
+    tau = mean - torch.sqrt(delta.clamp(min=0))                                         # (N, ) Threshold if the support were the top-rho elements
+
+    support_size = scatter_sum((tau <= z).type(torch.long), seg, dim=0, dim_size=len(counts)) # (nSeg, )
+    tau_star = tau.index_select(0, ptr + support_size - 1)                            # (nSeg, )
+    out_sorted = (z - tau_star.index_select(0, seg)).clamp(min=0).square()              # (N, )
+
+    return torch.empty_like(out_sorted).index_copy_(0, perm, out_sorted)
@@ -1,11 +1,48 @@
 import os
-from typing import Tuple
+import pickle
+import warnings
+from typing import List, Union
 import torch
 
 
+_constants_path = os.path.join(os.path.dirname(__file__), 'constants.pt')
 try:
-    _Jd, _W3j_flat, _W3j_indices = torch.load(os.path.join(os.path.dirname(__file__), 'constants.pt'))
-    _Jd: Tuple[torch.Tensor] = tuple(J.detach().clone().to(dtype=torch.float32) for J in _Jd)
-except Exception:
+    try:
+        _Jd, _W3j_flat, _W3j_indices = torch.load(_constants_path, mmap=True, weights_only=True) # Memory-mapped; shared across processes (e.g., DataLoader workers) via page cache.
+    except (TypeError, RuntimeError, pickle.UnpicklingError): # torch < 2.1 does not support mmap; legacy (non-zipfile) format cannot be memory-mapped; weights_only rejects the pickle
+        _Jd, _W3j_flat, _W3j_indices = torch.load(_constants_path)
+    _Jd: List[torch.Tensor] = [J.detach().to(dtype=torch.float32) for J in _Jd] # No copy if already float32. Consumers clone into their own buffers.
+except Exception as e:
+    warnings.warn(f"Failed to load {_constants_path} ({e!r}); falling back to e3nn.o3._wigner._Jd.")
     from e3nn.o3._wigner import _Jd
-    _Jd: Tuple[torch.Tensor] = tuple(J.detach().clone().to(dtype=torch.float32) for J in _Jd)
\ No newline at end of file
+    _Jd: List[torch.Tensor] = [J.detach().to(dtype=torch.float32) for J in _Jd]
+
+
+def _stack_Jd(Jd: List[torch.Tensor]) -> torch.Tensor:
+    """
+    Zero-pad and stack the J matrices into a single (Lmax+1, 2*Lmax+1, 2*Lmax+1) tensor, so that all l can be processed by one batched matmul.
+    """
+    lmax = len(Jd) - 1
+    Jd_stacked = Jd[0].new_zeros(lmax+1, 2*lmax+1, 2*lmax+1)
+    for l, J in enumerate(Jd):
+        Jd_stacked[l, :2*l+1, :2*l+1] = J
+    return Jd_stacked
+
+_Jd_stacked: torch.Tensor = _stack_Jd(_Jd) # (Lmax+1, 2*Lmax+1, 2*Lmax+1); _Jd[l] == _Jd_stacked[l, :2*l+1, :2*l+1]
+
+
+def wigner_J(l: int) -> torch.Tensor:
+    """
+    J matrix of irrep l, as a view of _Jd_stacked (no copy). Prefer this over indexing the _Jd list, which is kept for backward compatibility.
+    TorchScript cannot read module-level tensors, so scripted modules should register the result (or _Jd_stacked itself) as a buffer, as SliceAndTransform does.
+    """
+    return _Jd_stacked[l, :2*l+1, :2*l+1]
+
+
+def move_w3j_to(device: Union[str, torch.device]):
+    """
+    Move the module-level J matrices to device once, so that callers indexing _Jd directly do not copy them on every use.
+    """
+    global _Jd, _Jd_stacked
+    _Jd = [J.to(device=device) for J in _Jd]
+    _Jd_stacked = _Jd_stacked.to(device=device)
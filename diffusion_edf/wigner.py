@@ -212,7 +212,7 @@ class SliceAndTransform(torch.nn.Module):
         self.mul = mul
         self.l = l
         self.dim = 2*self.l+1
-        self.register_buffer("J", w3j._Jd[l].detach().clone())
+        self.register_buffer("J", w3j.wigner_J(l).clone())
         
         if allow_zero_len:
             assert end >= start, f"end ({end}) < start ({start})"
@@ -0,0 +1,26 @@
+import pytest
+import torch
+from torch_cluster import fps
+
+from diffusion_edf.connectivity import fps_fixed
+
+
+@pytest.mark.parametrize("dtype", [torch.float32, torch.float64])
+@pytest.mark.parametrize("ratio", [0.1, 0.3, 1/3, 0.7])
+@pytest.mark.parametrize("counts", [
+    [100, 37, 250],
+    [10, 3, 7, 20],   # ratio * count is (close to) an integer: float rounding decides ceil.
+    [1, 100, 1],      # Single-point batches.
+])
+def test_fps_fixed_matches_torch_cluster(counts, ratio, dtype):
+    src = torch.randn(sum(counts), 3, dtype=dtype)
+    batch = torch.repeat_interleave(torch.arange(len(counts)), torch.tensor(counts))
+
+    ref = fps(src=src, batch=batch, ratio=ratio, random_start=False)
+    assert torch.equal(fps_fixed(src=src, batch=batch, ratio=ratio, random_start=False), ref)
+    assert torch.equal(fps_fixed(src=src, batch=batch, ratio=ratio, random_start=False, n_iters=max(counts)), ref) # Loose n_iters bound.
+
+    out = fps_fixed(src=src, batch=batch, ratio=ratio, random_start=True)
+    assert len(out) == len(ref)
+    assert len(out.unique()) == len(out)
+    assert torch.equal(batch[out], batch[ref])  # Same per-batch counts, batch-major.
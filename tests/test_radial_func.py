@@ -0,0 +1,19 @@
+import pytest
+import torch
+
+from diffusion_edf.radial_func import gaussian, soft_square_cutoff, fused_gaussian_rbf_cutoff
+
+
+@pytest.mark.parametrize("infinite", [False, True])
+@pytest.mark.parametrize("offset,cutoff,thr", [(0.05, 1.5, 0.8), (0., 1., 0.5)])
+def test_fused_gaussian_rbf_cutoff_matches_unfused(offset, cutoff, thr, infinite):
+    num_basis = 10
+    dist = torch.linspace(-0.2, 1.2, 1001, dtype=torch.float64) * cutoff                # Covers both cutoff regions and out-of-range lengths.
+    mean = torch.linspace(0., 1., num_basis+2, dtype=torch.float64)[1:-1].unsqueeze(0)  # (1, num_basis)
+    std = torch.rand(1, num_basis, dtype=torch.float64) * 0.2 + 0.05
+    weight = torch.rand(1, num_basis, dtype=torch.float64) * 4.
+
+    x = ((dist - offset) / (cutoff - offset)).unsqueeze(-1)
+    ref = weight * gaussian(x.expand(-1, num_basis), mean, std) * soft_square_cutoff(x, thr=thr, infinite=infinite)
+    out = fused_gaussian_rbf_cutoff(dist, mean, std, weight, offset=offset, cutoff=cutoff, thr=thr, infinite=infinite)
+    torch.testing.assert_close(out, ref)
@@ -0,0 +1,19 @@
+import pytest
+import torch
+from torch_scatter import scatter_logsumexp
+
+from diffusion_edf.connectivity import degree_to_rowptr
+from diffusion_edf.graph_attention import segment_softmax_csr
+
+
+@pytest.mark.parametrize("n_nodes,n_edges,n_heads", [(50, 1000, 4), (20, 200, 1), (200, 100, 2)]) # The last one has many nodes without edges.
+def test_segment_softmax_csr_matches_scatter_logsumexp(n_nodes, n_edges, n_heads):
+    edge_dst = torch.sort(torch.randint(n_nodes, (n_edges,))).values
+    rowptr = degree_to_rowptr(torch.bincount(edge_dst, minlength=n_nodes))
+    log_alpha = (torch.randn(n_edges, n_heads, dtype=torch.float64) * 5.).requires_grad_(True)
+    grad_out = torch.randn_like(log_alpha)
+
+    out = segment_softmax_csr(log_alpha, rowptr)
+    ref = torch.exp(log_alpha - scatter_logsumexp(log_alpha, edge_dst, dim=-2, dim_size=n_nodes)[edge_dst])
+    torch.testing.assert_close(out, ref)
+    torch.testing.assert_close(torch.autograd.grad(out, log_alpha, grad_out)[0], torch.autograd.grad(ref, log_alpha, grad_out)[0])
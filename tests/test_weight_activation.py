@@ -0,0 +1,34 @@
+import pytest
+import torch
+
+from diffusion_edf.utils import scatter_entmax15, sorted_scatter_softmax
+
+
+def _bisection_entmax15(z: torch.Tensor, n_iters: int = 100) -> torch.Tensor:
+    # entmax15(z)_i = max(z_i/2 - tau, 0)^2 with sum_i = 1; the sum is monotonically decreasing in tau.
+    z = z / 2
+    tau_lo, tau_hi = z.max() - 1, z.max()
+    for _ in range(n_iters):
+        tau = (tau_lo + tau_hi) / 2
+        if (z - tau).clamp(min=0).square().sum() > 1:
+            tau_lo = tau
+        else:
+            tau_hi = tau
+    return (z - (tau_lo + tau_hi) / 2).clamp(min=0).square()
+
+
+@pytest.mark.parametrize("activation,reference,sorted_index", [
+    (scatter_entmax15, _bisection_entmax15, False),
+    (sorted_scatter_softmax, lambda z: torch.softmax(z, dim=-1), True),
+])
+@pytest.mark.parametrize("n,n_groups", [(300, 7), (5, 5)]) # The latter has single-element groups.
+def test_weight_activation_matches_per_group_reference(activation, reference, sorted_index, n, n_groups):
+    index = torch.randint(n_groups, (n,))
+    if sorted_index:
+        index = torch.sort(index).values
+    src = torch.randn(n, dtype=torch.float64) * 3.
+
+    out = activation(src, index)
+    for g in index.unique():
+        mask = index == g
+        torch.testing.assert_close(out[mask], reference(src[mask]))